@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+# This software is released under the terms of the MIT license. See the LICENSE file for details.
+
+"""
+Headless performance benchmarks for pyplaybin. Test media is
+synthesized at setup with videotestsrc/audiotestsrc, and all sinks
+are fake or app sinks, so this runs without a display or sound
+card. Results are written as JSON.
+"""
+
+import sys, os, asyncio, time, json, argparse, tempfile, statistics, platform, resource
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from pyplaybin import Playbin
+
+#==============================================================================
+# Test media
+
+
+VIDEO_ENCODERS = [
+    ('x264enc', 'x264enc key-int-max=60 speed-preset=ultrafast ! h264parse'),
+    ('vp8enc', 'vp8enc keyframe-max-dist=60 deadline=1'),
+    ('theoraenc', 'theoraenc'),
+]
+
+AUDIO_ENCODERS = [
+    ('vorbisenc', 'vorbisenc'),
+    ('opusenc', 'opusenc'),
+    ('lamemp3enc', 'lamemp3enc ! mpegaudioparse'),
+]
+
+
+def first_available(candidates):
+    for factory, description in candidates:
+        if Gst.ElementFactory.find(factory) is not None:
+            return description
+    raise RuntimeError('None of %s is available' % ', '.join(factory for factory, description in candidates))
+
+
+def make_media(filename, seconds, width=640, height=360, rate=30):
+    """
+    Encodes a test file with one video track and two audio tracks
+    (tagged 'eng' and 'fra') into a Matroska container.
+    """
+    video = first_available(VIDEO_ENCODERS)
+    audio = first_available(AUDIO_ENCODERS)
+    frames = seconds * rate
+    buffers = seconds * 44100 // 1024
+    pipeline = Gst.parse_launch(
+        'matroskamux name=mux ! filesink location="%s" '
+        'videotestsrc num-buffers=%d pattern=ball ! video/x-raw,width=%d,height=%d,framerate=%d/1 ! videoconvert ! %s ! queue ! mux. '
+        'audiotestsrc num-buffers=%d samplesperbuffer=1024 freq=440 ! taginject tags="language-code=eng" ! audioconvert ! %s ! queue ! mux. '
+        'audiotestsrc num-buffers=%d samplesperbuffer=1024 freq=880 ! taginject tags="language-code=fra" ! audioconvert ! %s ! queue ! mux. '
+        % (filename, frames, width, height, rate, video, buffers, audio, buffers, audio))
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS|Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        raise RuntimeError('Cannot create test media: %s' % msg.parse_error()[0])
+
+#==============================================================================
+# Headless players
+
+
+class FakePlaybin(Playbin):
+    def create_video_sink(self, name):
+        sink = Gst.ElementFactory.make('fakesink', name)
+        sink.set_property('sync', True)
+        return sink
+
+    def create_audio_sink(self, name):
+        sink = Gst.ElementFactory.make('fakesink', name)
+        sink.set_property('sync', True)
+        return sink
+
+
+class CountingPlaybin(FakePlaybin):
+    """
+    Delivers every decoded frame to Python through an appsink, as
+    fast as possible.
+    """
+
+    frames = 0
+
+    def create_video_sink(self, name):
+        sink = Gst.ElementFactory.make('appsink', name)
+        sink.set_property('sync', False)
+        sink.set_property('emit-signals', True)
+        sink.connect('new-sample', self._new_sample)
+        return sink
+
+    def create_audio_sink(self, name):
+        sink = Gst.ElementFactory.make('fakesink', name)
+        sink.set_property('sync', False)
+        return sink
+
+    def _new_sample(self, sink):
+        sink.emit('pull-sample')
+        self.frames += 1
+        return Gst.FlowReturn.OK
+
+#==============================================================================
+# Measurements
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'min': samples[0],
+        'median': statistics.median(samples),
+        'p90': samples[int(0.9 * (len(samples) - 1))],
+        'max': samples[-1],
+    }
+
+
+def rss():
+    """Current resident set size, in bytes."""
+    try:
+        with open('/proc/self/statm') as fileobj:
+            return int(fileobj.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        scale = 1 if platform.system() == 'Darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+async def bench_construction(filename, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        FakePlaybin()
+        samples.append(time.perf_counter() - started)
+    return summary(samples)
+
+
+async def bench_time_to_playing(filename, iterations):
+    samples = []
+    for _ in range(iterations):
+        player = FakePlaybin()
+        started = time.perf_counter()
+        await player.play(filename)
+        samples.append(time.perf_counter() - started)
+        await player.stop()
+    return summary(samples)
+
+
+async def bench_seek(filename, iterations):
+    player = FakePlaybin()
+    await player.play(filename)
+    await player.pause()
+    duration = player.duration
+    results = dict()
+    for accurate in (False, True):
+        samples = []
+        for index in range(iterations):
+            position = duration * ((index * 7) % iterations + 0.5) // iterations
+            started = time.perf_counter()
+            await player.seek(position, accurate=accurate)
+            samples.append(time.perf_counter() - started)
+        results['accurate' if accurate else 'key_unit'] = summary(samples)
+    await player.stop()
+    return results
+
+
+async def bench_track_switch(filename, iterations):
+    player = FakePlaybin()
+    await player.play(filename)
+    tracks = player.audio_tracks()
+    if len(tracks) < 2:
+        await player.stop()
+        return None
+    sink = player._playbin.get_property('audio-sink').get_static_pad('sink')
+    samples = []
+    for index in range(iterations):
+        ft = asyncio.get_running_loop().create_future()
+        track = tracks[(index + 1) % len(tracks)]
+        stream_id = player._playbin.stream_id('audio', track.index)
+        switched = [False]
+        def probe(pad, info):
+            # Buffers already past the input-selector still belong to
+            # the old track: wait for the new track's STREAM_START.
+            if info.type & Gst.PadProbeType.EVENT_DOWNSTREAM:
+                event = info.get_event()
+                if event.type == Gst.EventType.STREAM_START and stream_id in (None, event.parse_stream_start()):
+                    switched[0] = True
+                return Gst.PadProbeReturn.OK
+            if not switched[0]:
+                return Gst.PadProbeReturn.OK
+            now = time.perf_counter()
+            player.call_from_thread(lambda: ft.done() or ft.set_result(now))
+            return Gst.PadProbeReturn.REMOVE
+        sink.add_probe(Gst.PadProbeType.BUFFER|Gst.PadProbeType.EVENT_DOWNSTREAM, probe)
+        started = time.perf_counter()
+        player.audio_track = track
+        samples.append((await ft) - started)
+    await player.stop()
+    return summary(samples)
+
+
+async def bench_frame_delivery(filename, iterations):
+    samples = []
+    for _ in range(iterations):
+        player = CountingPlaybin()
+        done = asyncio.get_running_loop().create_future()
+        player.end_of_stream = lambda: done.set_result(None)
+        started = time.perf_counter()
+        await player.play(filename)
+        await done
+        samples.append(player.frames / (time.perf_counter() - started))
+        await player.stop()
+    return summary(samples)
+
+
+async def bench_call_overhead(filename, iterations):
+    """
+    Per-call cost of the asynchronous wrappers themselves: pause() on
+    a paused pipeline and play() on a playing one complete
+    synchronously in GStreamer. A seek always round-trips through the
+    streaming threads; seeking a paused pipeline to its start keeps
+    that part as small as possible.
+    """
+    player = FakePlaybin()
+    await player.play(filename)
+
+    async def measure(call, calls):
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            for _ in range(calls):
+                await call()
+            samples.append((time.perf_counter() - started) / calls)
+        return summary(samples)
+
+    results = dict()
+    results['play'] = await measure(player.play, 1000)
+    await player.pause()
+    results['pause'] = await measure(player.pause, 1000)
+    results['seek'] = await measure(lambda: player.seek(0), 10)
+    await player.stop()
+    return results
+
+
+def compare(results, baseline):
+    """
+    Ratios of the medians in `results` to those in `baseline` (below
+    1.0 is faster), for every measurement found in both.
+    """
+    ratios = dict()
+    for key, value in results.items():
+        if not isinstance(value, dict) or not isinstance(baseline.get(key), dict):
+            continue
+        if 'median' in value and 'median' in baseline[key]:
+            if baseline[key]['median']:
+                ratios[key] = value['median'] / baseline[key]['median']
+        else:
+            nested = compare(value, baseline[key])
+            if nested:
+                ratios[key] = nested
+    return ratios
+
+
+async def bench_memory(filename, counts):
+    results = dict()
+    for count in counts:
+        before = rss()
+        players = [FakePlaybin() for _ in range(count)]
+        for player in players:
+            await player.play(filename)
+            await player.pause()
+        results[str(count)] = (rss() - before) // count
+        for player in players:
+            await player.stop()
+        del players
+    return results
+
+
+async def run(args):
+    tmpdir = tempfile.mkdtemp(prefix='pyplaybin-bench-')
+    filename = os.path.join(tmpdir, 'test.mkv')
+    make_media(filename, args.seconds)
+    iterations = args.iterations
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'gstreamer': Gst.version_string(),
+            'platform': platform.platform(),
+        },
+        'construction_seconds': (await bench_construction(filename, iterations)),
+        'time_to_playing_seconds': (await bench_time_to_playing(filename, iterations)),
+        'seek_seconds': (await bench_seek(filename, iterations)),
+        'call_overhead_seconds': (await bench_call_overhead(filename, iterations)),
+        'track_switch_seconds': (await bench_track_switch(filename, iterations)),
+        'frame_delivery_fps': (await bench_frame_delivery(filename, max(1, iterations // 10))),
+        'memory_per_pipeline_bytes': (await bench_memory(filename, args.instances)),
+    }
+    os.remove(filename)
+    os.rmdir(tmpdir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-o', '--output', help='Write results to this file instead of stdout')
+    parser.add_argument('-n', '--iterations', type=int, default=20, help='Iterations per measurement')
+    parser.add_argument('-s', '--seconds', type=int, default=20, help='Duration of the test media')
+    parser.add_argument('-i', '--instances', type=int, nargs='+', default=[1, 10, 100], help='Pipeline counts for the memory measurement')
+    parser.add_argument('-b', '--baseline', help='Compare with the results in this file, written by an earlier run')
+    args = parser.parse_args()
+
+    Playbin.start_glib_loop()
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        Playbin.stop_glib_loop()
+
+    if args.baseline:
+        with open(args.baseline) as fileobj:
+            results['baseline'] = compare(results, json.load(fileobj))
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fileobj:
+            fileobj.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
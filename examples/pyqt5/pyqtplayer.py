@@ -1,6 +1,6 @@
 #!/usr/bin/python
 
-import sys, os, asyncio, platform, functools
+import sys, os, asyncio, functools
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
 import gi
@@ -9,6 +9,10 @@ from gi.repository import Gst
 
 from pyplaybin import Playbin, StreamTrack, PlaybinError
 from PyQt5 import QtCore, QtGui, QtWidgets
+try:
+    from PyQt5 import sip
+except ImportError:
+    import sip
 from quamash import QEventLoop
 
 #==============================================================================
@@ -84,16 +88,14 @@ class SeekSlider(QtWidgets.QWidget):
     def remainingWidget(self):
         return self._remaining
 
-    @asyncio.coroutine
-    def stop(self):
+    async def stop(self):
         if self._updater is not None:
             self._updater.cancel()
-            yield from self._updater
+            await self._updater
             self._updater = None
         self._state = self.STATE_IDLE
 
-    @asyncio.coroutine
-    def _poll(self):
+    async def _poll(self):
         try:
             while True: # Exit on CancelledError actually
                 if self._state == self.STATE_IDLE:
@@ -107,29 +109,29 @@ class SeekSlider(QtWidgets.QWidget):
                         self._slider.setValue(position)
                         self._elapsed.setText(formatSeconds(position, short=True))
                         self._remaining.setText(formatSeconds(duration - position, short=True))
-                yield from asyncio.sleep(1)
+                await asyncio.sleep(1)
         except asyncio.CancelledError:
             pass
 
     @async_slot
-    def _startDragging(self):
+    async def _startDragging(self):
         self._state = self.STATE_PAUSING
         self._started = self._playbin.position // Gst.SECOND
-        yield from self._playbin.pause()
+        await self._playbin.pause()
         if self._state == self.STATE_IDLE:
-            yield from self._playbin.play()
+            await self._playbin.play()
         else:
             self._state = self.STATE_SEEKING
 
     @async_slot
-    def _stopDragging(self):
+    async def _stopDragging(self):
         state, self._state = self._state, self.STATE_IDLE
         if state == self.STATE_SEEKING:
-            yield from self._playbin.play()
+            await self._playbin.play()
         QtWidgets.QToolTip.hideText()
 
     @async_slot
-    def _drag(self, value):
+    async def _drag(self, value):
         delta = value - self._started
         text = formatSeconds(abs(delta), short=True)
         text = ('+' if delta >= 0 else '-') + text
@@ -137,7 +139,7 @@ class SeekSlider(QtWidgets.QWidget):
 
         self._elapsed.setText(formatSeconds(value, short=True))
         self._remaining.setText(formatSeconds(self._slider.maximum() - value, short=True))
-        yield from self._playbin.seek(value * Gst.SECOND)
+        await self._playbin.seek(value * Gst.SECOND)
 
 #==============================================================================
 # Subtitle/audio track selection
@@ -219,6 +221,80 @@ class AudioSelectionAction(MultipleChoiceAction):
     def _getTracks(self):
         yield from self._playbin.audio_tracks()
 
+#==============================================================================
+# Video rendering
+
+
+class VideoWidget(QtWidgets.QWidget):
+    # Renders the frames of an appsink created with create_sink(). The
+    # streaming thread only keeps the latest sample, so frames the UI
+    # is too busy to paint are dropped instead of stalling decoding,
+    # and wakes the asyncio loop up to repaint. Painting wraps the
+    # mapped buffer in a QImage without copying it.
+
+    # QImage.Format_RGB32 is 0xffRRGGBB in native byte order.
+    CAPS = 'video/x-raw,format=%s' % ('BGRx' if sys.byteorder == 'little' else 'xRGB')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._loop = asyncio.get_event_loop()
+        self._latest = None
+        self._sample = None
+        self._pending = False
+        self.setAttribute(QtCore.Qt.WA_OpaquePaintEvent)
+        self.setMouseTracking(True)
+
+    def create_sink(self, name):
+        sink = Gst.ElementFactory.make('appsink', name)
+        sink.set_property('caps', Gst.Caps.from_string(self.CAPS))
+        sink.set_property('max-buffers', 1)
+        sink.set_property('drop', True)
+        sink.set_property('emit-signals', True)
+        sink.connect('new-sample', self._new_sample)
+        sink.connect('new-preroll', self._new_preroll)
+        return sink
+
+    def _new_sample(self, sink):
+        self._handoff(sink.emit('pull-sample'))
+        return Gst.FlowReturn.OK
+
+    def _new_preroll(self, sink):
+        self._handoff(sink.emit('pull-preroll'))
+        return Gst.FlowReturn.OK
+
+    def _handoff(self, sample):
+        # Latest frame wins; at most one repaint is queued at a time.
+        self._latest = sample
+        if not self._pending:
+            self._pending = True
+            self._loop.call_soon_threadsafe(self._present)
+
+    def _present(self):
+        self._pending = False
+        sample = self._latest
+        if sample is not self._sample:
+            self._sample = sample
+            self.update()
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.black)
+        sample = self._sample
+        if sample is not None:
+            caps = sample.get_caps().get_structure(0)
+            width, height = caps.get_int('width')[1], caps.get_int('height')[1]
+            buf = sample.get_buffer()
+            ok, info = buf.map(Gst.MapFlags.READ)
+            if ok:
+                try:
+                    image = QtGui.QImage(sip.voidptr(info.data), width, height, info.size // height, QtGui.QImage.Format_RGB32)
+                    target = QtCore.QRect(QtCore.QPoint(0, 0), image.size().scaled(self.size(), QtCore.Qt.KeepAspectRatio))
+                    target.moveCenter(self.rect().center())
+                    painter.drawImage(target, image)
+                finally:
+                    buf.unmap(info)
+        painter.end()
+
 #==============================================================================
 # Video viewport
 
@@ -232,14 +308,20 @@ class Viewport(QtWidgets.QWidget):
         self._controls = controls
         self.setWindowTitle(filename)
         self.setMouseTracking(True)
+        self.video = VideoWidget(self)
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.video)
+        self.setLayout(layout)
         self.setWindowState(self.windowState() | QtCore.Qt.WindowFullScreen)
         self.show()
 
     def mouseMoveEvent(self, event):
         self._controls.onUserActivity()
 
-    @asyncio.coroutine
-    def start_playing(self, filename):
+    async def start_playing(self, filename):
+        video = self.video
+
         class QtPlaybin(Playbin, QtCore.QObject):
             eos = QtCore.pyqtSignal()
 
@@ -247,17 +329,11 @@ class Viewport(QtWidgets.QWidget):
                 self.eos.emit()
 
             def create_video_sink(self, name):
-                if platform.system() == 'Darwin':
-                    # default (gl) sink does not play well with GstOverlay, at least not when using Qt
-                    return Gst.ElementFactory.make('osxvideosink', name)
-                elif platform.system() == 'Linux':
-                    # Same for the default on Linux...
-                    return Gst.ElementFactory.make('xvimagesink', name)
-                return super().create_video_sink(name)
-
-        self.playbin = QtPlaybin(win_id=self.winId())
+                return video.create_sink(name)
+
+        self.playbin = QtPlaybin()
         self.playbin.eos.connect(self.close)
-        yield from self.playbin.play(filename)
+        await self.playbin.play(filename)
 
     def closeEvent(self, event):
         asyncio.get_event_loop().create_task(self.playbin.stop())
@@ -290,14 +366,13 @@ class Player(QtWidgets.QWidget):
         self._showAnimation = None
         asyncio.get_event_loop().create_task(self._setup(filename))
 
-    @asyncio.coroutine
-    def _setup(self, filename):
+    async def _setup(self, filename):
         self._viewport = Viewport(self, filename)
         self._viewport.geometry_changed.connect(self._recenter)
         self._viewport.playback_stopped.connect(self._playback_stopped)
         self._isPlaying = True
         self._hideTimer = None
-        yield from self._viewport.start_playing(filename)
+        await self._viewport.start_playing(filename)
 
         toolbar = QtWidgets.QToolBar(self)
         toolbar.setStyleSheet('QToolBar { background-color : rgba(255,255,255,100) ; color:white; border-color: transparent;} QToolButton{background-color : transparent;}')
@@ -408,18 +483,18 @@ class Player(QtWidgets.QWidget):
         self.setGeometry(rect)
 
     @async_slot
-    def _rewind(self, toggled=False):
-        yield from self._viewport.playbin.rewind(60)
+    async def _rewind(self, toggled=False):
+        await self._viewport.playbin.rewind(60)
 
     @async_slot
-    def _toggle_play_state(self, toggled=False):
+    async def _toggle_play_state(self, toggled=False):
         if self._isPlaying:
             self._playPause.setIcon(QtGui.QIcon('../icons/play.svg'))
-            yield from self._viewport.playbin.pause()
+            await self._viewport.playbin.pause()
             self._isPlaying = False
         else:
             self._playPause.setIcon(QtGui.QIcon('../icons/pause.svg'))
-            yield from self._viewport.playbin.play()
+            await self._viewport.playbin.play()
             self._isPlaying = True
 
     def _stop_playback(self, toggled=False):
@@ -427,15 +502,15 @@ class Player(QtWidgets.QWidget):
         self._playback_stopped()
 
     @async_slot
-    def _playback_stopped(self):
-        yield from self._seeker.stop()
-        yield from self._viewport.playbin.stop()
+    async def _playback_stopped(self):
+        await self._seeker.stop()
+        await self._viewport.playbin.stop()
         self.close()
         self.playback_stopped.emit()
 
     @async_slot
-    def _forward(self, toggled=False):
-        yield from self._viewport.playbin.forward(60)
+    async def _forward(self, toggled=False):
+        await self._viewport.playbin.forward(60)
 
 
 class MainViewport(QtWidgets.QWidget):
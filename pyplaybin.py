@@ -7,22 +7,148 @@
 Thin wrapper around GStreamer's playbin2, using asyncio-style asynchronous methods.
 """
 
-import gi
-gi.require_version('Gst', '1.0')
-gi.require_version('GstVideo', '1.0')
-gi.require_version('GstTag', '1.0')
+import os, threading, functools, asyncio, collections, platform, hashlib, json, multiprocessing, math, time, weakref, bisect, contextlib, re, html, importlib
 
-from gi.repository import Gst, GstVideo, GstTag, GObject
-import os, threading, functools, asyncio, sys, collections, platform
+
+class _LazyRepository(object):
+    """
+    Placeholder for a gi.repository module; GStreamer is loaded on
+    first attribute access, which replaces all placeholders.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        init_gstreamer()
+        return getattr(globals()[self._name], attr)
+
+
+Gst = _LazyRepository('Gst')
+GstVideo = _LazyRepository('GstVideo')
+GstTag = _LazyRepository('GstTag')
+GObject = _LazyRepository('GObject')
+GLib = _LazyRepository('GLib')
+numpy = None
+
+_init_lock = threading.Lock()
+_startup = collections.OrderedDict()
+
+
+def init_gstreamer():
+    """
+    Loads the GStreamer typelibs and initializes GStreamer, unless
+    already done. This happens automatically on first use, so
+    importing this module is cheap; see also :func:`prewarm`.
+    """
+    global Gst, GstVideo, GstTag, GObject, GLib
+    with _init_lock:
+        if not isinstance(Gst, _LazyRepository):
+            return
+        started = time.perf_counter()
+        import gi
+        gi.require_version('Gst', '1.0')
+        gi.require_version('GstVideo', '1.0')
+        gi.require_version('GstTag', '1.0')
+        from gi.repository import Gst as gst, GstVideo as gstvideo, GstTag as gsttag, GObject as gobject, GLib as glib
+        loaded = time.perf_counter()
+        gst.init(None)
+        _startup['typelibs'] = loaded - started
+        _startup['init'] = time.perf_counter() - loaded
+        GstVideo, GstTag, GObject, GLib = gstvideo, gsttag, gobject, glib
+        Gst = gst
+
+
+def prewarm(elements=('playbin', 'uridecodebin', 'decodebin', 'autovideosink', 'autoaudiosink')):
+    """
+    Initializes GStreamer in a background thread and loads the
+    plugins providing `elements`, so that the first pipeline does
+    not pay for it. Returns the thread.
+    """
+    def run():
+        init_gstreamer()
+        started = time.perf_counter()
+        for name in elements:
+            factory = Gst.ElementFactory.find(name)
+            if factory is not None:
+                factory.load()
+        _startup['prewarm'] = time.perf_counter() - started
+    thread = threading.Thread(target=run, name='pyplaybin-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+def startup_report():
+    """
+    Returns a dictionary of the time spent, in seconds, loading the
+    typelibs ('typelibs'), in Gst.init ('init') and loading plugins
+    in :func:`prewarm` ('prewarm'), for the steps that happened.
+    """
+    return dict(_startup)
+
+
+def require_numpy(feature):
+    """
+    Imports NumPy on first use; raises :class:`PlaybinError` naming
+    `feature` if it is not installed.
+    """
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            raise PlaybinError('NumPy is required for %s' % feature)
+        numpy = module
+    return numpy
+
+
+_typelibs = {}
+
+
+def require_typelib(name, feature):
+    """
+    Loads an optional GStreamer typelib (such as 'GstNet') on first
+    use and returns it; raises :class:`PlaybinError` naming `feature`
+    if it is not installed.
+    """
+    if name not in _typelibs:
+        init_gstreamer()
+        try:
+            import gi
+            gi.require_version(name, '1.0')
+            _typelibs[name] = importlib.import_module('gi.repository.%s' % name)
+        except (ImportError, ValueError):
+            raise PlaybinError('%s is required for %s' % (name, feature))
+    return _typelibs[name]
+
+
+def current_loop():
+    """
+    Returns the running event loop, or the current one when called
+    from outside a coroutine.
+    """
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.get_event_loop()
 
 
-def create_future():
+def create_future(loop=None):
     """
-    Create a future, Python 3.4 and 3.5 compatible
+    Create a future on `loop`, or on the current event loop if not
+    specified.
     """
-    if sys.version_info >= (3, 5, 2):
-        return asyncio.get_event_loop().create_future()
-    return asyncio.Future()
+    return (loop or current_loop()).create_future()
+
+
+def to_uri(location):
+    """
+    Returns `location` if it is already a URI, else the file URI for
+    this path.
+    """
+    if Gst.uri_is_valid(location):
+        return location
+    return Gst.filename_to_uri(os.path.abspath(location))
 
 
 class PlaybinError(Exception):
@@ -44,6 +170,12 @@ class PlaybinGstError(PlaybinError):
         return '%s: %s' % (self.code, super().__str__())
 
 
+class PlaybinTimeout(PlaybinError):
+    """
+    An asynchronous operation did not complete in time.
+    """
+
+
 class StreamTrack(collections.namedtuple('StreamTrack', ['index', 'lang'])):
     """
     This class abstracts a track in a media file (subtitle, audio track).
@@ -53,39 +185,671 @@ class StreamTrack(collections.namedtuple('StreamTrack', ['index', 'lang'])):
         return 'Unknown' if self.lang is None else self.lang
 
 
+class Latency(collections.namedtuple('Latency', ['live', 'min', 'max'])):
+    """
+    Result of a latency query: whether the pipeline is live, and its
+    minimum and maximum latency in GStreamer units.
+    """
+
+
+class QueueLimits(collections.namedtuple('QueueLimits', ['bytes', 'buffers', 'time'])):
+    """
+    Limits applied to the internal queue, queue2 and multiqueue
+    elements of a pipeline: maximum bytes, buffers and time (in
+    GStreamer units). None leaves GStreamer's default, 0 means
+    unlimited.
+    """
+
+    def __new__(cls, bytes=None, buffers=None, time=None):
+        return super().__new__(cls, bytes, buffers, time)
+
+
+class PlaybackStats(collections.namedtuple('PlaybackStats', ['rendered', 'dropped', 'jitter', 'proportion', 'rate'])):
+    """
+    Video rendering statistics: number of frames rendered and
+    dropped, last jitter (in GStreamer units, positive when late)
+    and proportion reported in QoS messages, and average rendering
+    rate in frames per second.
+    """
+
+
+class StatsStream(object):
+    """
+    Periodic stream of :class:`PlaybackStats`, every `interval`
+    seconds. Use either `await stream.next()` or `async for`.
+    """
+
+    def __init__(self, player, interval):
+        self._player = player
+        self._interval = interval
+        self._deadline = None
+
+    async def next(self):
+        """
+        **asynchronous**
+        Waits for the next period and returns the current stats.
+        """
+        loop = self._player._async_loop
+        self._deadline = (self._deadline or loop.time()) + self._interval
+        await asyncio.sleep(max(0, self._deadline - loop.time()))
+        return self._player.stats()
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self.next()
+
+
+class AudioLevels(collections.namedtuple('AudioLevels', ['timestamps', 'rms', 'peak', 'decay'])):
+    """
+    A batch of audio level measurements, as NumPy arrays: stream
+    times in GStreamer units, of shape (n,), and RMS, peak and
+    decaying peak levels in dB, of shape (n, channels).
+    """
+
+
+class AudioSpectrum(collections.namedtuple('AudioSpectrum', ['timestamps', 'frequencies', 'magnitudes'])):
+    """
+    A batch of audio spectra, as NumPy arrays: stream times in
+    GStreamer units, of shape (n,), band center frequencies in Hz, of
+    shape (bands,), and magnitudes in dB, of shape (n, bands).
+    """
+
+
+class AnalysisStream(object):
+    """
+    Stream of audio analysis batches (:class:`AudioLevels` or
+    :class:`AudioSpectrum`), every `interval` seconds. Use either
+    `await stream.next()` or `async for`. Measurements are queued
+    between batches; beyond `capacity`, the oldest are dropped.
+    """
+
+    def __init__(self, player, kind, interval, capacity):
+        self._player = player
+        self._kind = kind
+        self._interval = interval
+        self._deadline = None
+        self._rows = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.closed = False
+        """True once :func:`close` has been called."""
+
+    def _push(self, row):
+        with self._lock:
+            self._rows.append(row)
+
+    async def next(self):
+        """
+        **asynchronous**
+        Waits for the next period and returns the measurements
+        received since the previous one.
+        """
+        loop = self._player._async_loop
+        self._deadline = (self._deadline or loop.time()) + self._interval
+        await asyncio.sleep(max(0, self._deadline - loop.time()))
+        with self._lock:
+            rows = list(self._rows)
+            self._rows.clear()
+        return self._player._analysis_batch(self._kind, rows)
+
+    def close(self):
+        """
+        Stops the stream; the analysis element stops posting
+        measurements when no stream uses it anymore.
+        """
+        self.closed = True
+        self._player._close_analysis(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        return await self.next()
+
+
+_ANALYSIS_FIELDS = dict((field, re.compile(r'\b%s=\(\w+\)[<{]([^>}]*)[>}]' % field)) for field in ('rms', 'peak', 'decay', 'magnitude'))
+
+
+def _parse_analysis(text, field):
+    # Serialized arrays are parsed by NumPy directly, rather than
+    # through one Python float per value.
+    return numpy.fromstring(_ANALYSIS_FIELDS[field].search(text).group(1), sep=',')
+
+
+class VideoFrame(collections.namedtuple('VideoFrame', ['data', 'format', 'width', 'height', 'pts'])):
+    """
+    A single video frame. `data` is the raw bytes (encoded image, or
+    packed pixels if `format` is a single-plane raw pixel format, row
+    padding being removed); `pts` is the presentation timestamp in
+    GStreamer units.
+    """
+
+    @classmethod
+    def from_sample(cls, sample):
+        buf = sample.get_buffer()
+        caps = sample.get_caps().get_structure(0)
+        fmt = caps.get_string('format') if caps.has_field('format') else caps.get_name()
+        width, height = caps.get_int('width')[1], caps.get_int('height')[1]
+        data = buf.extract_dup(0, buf.get_size())
+        if caps.get_name() == 'video/x-raw':
+            data = cls._pack(data, sample.get_caps(), width, height)
+        return cls(data, fmt, width, height, buf.pts)
+
+    @staticmethod
+    def _pack(data, caps, width, height):
+        # Raw video rows are padded (to 4 bytes by default); strip the
+        # padding of single-plane formats.
+        info = GstVideo.VideoInfo()
+        if not info.from_caps(caps) or info.finfo.n_planes != 1:
+            return data
+        stride, row = info.stride[0], width * info.finfo.pixel_stride[0]
+        if stride == row:
+            return data
+        offset = info.offset[0]
+        return b''.join(data[offset + index * stride:offset + index * stride + row] for index in range(height))
+
+
+def frame_caps(format, width=None, height=None):
+    """
+    Build caps for a video frame conversion. `format` is either 'raw'
+    (packed RGB) or an image media type such as 'image/png'.
+    """
+    caps = 'video/x-raw,format=RGB' if format == 'raw' else format
+    if width is not None:
+        caps += ',width=%d' % width
+    if height is not None:
+        caps += ',height=%d' % height
+    return Gst.Caps.from_string(caps)
+
+
+class FrameCache(object):
+    """
+    Bounded ring buffer of the most recently decoded video frames. It
+    is fed from a pad probe in the streaming thread and flushed on
+    seeks. Frames are only captured between :func:`start` and
+    :func:`stop` (while stepping), since buffers are deep-copied so
+    that holding them does not starve the decoder's buffer pool.
+    """
+
+    def __init__(self, size):
+        self._samples = collections.deque(maxlen=size)
+        self._active = False
+
+    def attach(self, pad):
+        pad.add_probe(Gst.PadProbeType.BUFFER|Gst.PadProbeType.EVENT_FLUSH, self._probe)
+
+    def start(self, sample):
+        """
+        Starts capturing frames, `sample` (the current frame) first.
+        """
+        if not self._active:
+            self._samples.clear()
+            self._samples.append(Gst.Sample.new(sample.get_buffer().copy_deep(), sample.get_caps(), None, None))
+            self._active = True
+
+    def stop(self):
+        """
+        Stops capturing frames and empties the cache.
+        """
+        self._active = False
+        self._samples.clear()
+
+    def _probe(self, pad, info):
+        if not self._active:
+            return Gst.PadProbeReturn.OK
+        if info.type & Gst.PadProbeType.BUFFER:
+            self._samples.append(Gst.Sample.new(info.get_buffer().copy_deep(), pad.get_current_caps(), None, None))
+        elif info.get_event().type == Gst.EventType.FLUSH_STOP:
+            self._samples.clear()
+        return Gst.PadProbeReturn.OK
+
+    def history(self, pts):
+        """
+        Returns the cached samples up to and including the one with
+        timestamp `pts`, oldest first; empty if it is not cached.
+        """
+        samples = list(self._samples)
+        for idx in range(len(samples) - 1, -1, -1):
+            if samples[idx].get_buffer().pts == pts:
+                return samples[:idx + 1]
+        return []
+
+
+class MemoryBudget(object):
+    """
+    A buffering memory budget of `total` bytes shared by several
+    pipelines: each one gets an equal share, split between its
+    queues, and shares are updated as pipelines come and go.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self._lock = threading.Lock()
+        self._players = weakref.WeakSet()
+
+    def share(self):
+        """
+        Returns the number of bytes each pipeline may buffer.
+        """
+        with self._lock:
+            return self.total // max(1, len(self._players))
+
+    # Shares only change with membership: adding a member twice (on
+    # every resume) or removing a non-member applies nothing.
+
+    def add(self, player):
+        with self._lock:
+            if player in self._players:
+                return
+            self._players.add(player)
+            players = list(self._players)
+        for player in players:
+            player._apply_queue_limits()
+
+    def remove(self, player):
+        with self._lock:
+            if player not in self._players:
+                return
+            self._players.discard(player)
+            players = list(self._players)
+        for player in players:
+            player._apply_queue_limits()
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of operation latencies, in seconds, with fixed
+    exponential buckets.
+    """
+
+    BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        """Number of observations per bucket; the last one is unbounded."""
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """
+        Returns an upper bound of the `q` quantile (0.0 to 1.0), or
+        None if there were no observations.
+        """
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.BOUNDS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class OperationMetrics(object):
+    """
+    Latency histograms per operation name: play, pause, stop, seek,
+    step, open (loading a file until it reaches the requested state,
+    playing or paused), preroll (loading a file until it is ready to
+    play, that is paused) and first_frame (loading a file until its
+    first video frame is rendered). Every :class:`Playbin` has one; all observations are
+    also aggregated into the module-level `process_metrics`.
+    """
+
+    BOUND_LABELS = tuple('%r' % bound for bound in LatencyHistogram.BOUNDS) + ('+Inf',)
+
+    def __init__(self, parent=None):
+        self._lock = threading.Lock()
+        self._parent = parent
+        self.histograms = dict()
+        """Maps operation names to :class:`LatencyHistogram` objects."""
+
+    def observe(self, name, seconds):
+        with self._lock:
+            try:
+                histogram = self.histograms[name]
+            except KeyError:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.observe(seconds)
+        if self._parent is not None:
+            self._parent.observe(name, seconds)
+
+    def to_prometheus(self, metric='pyplaybin_operation_seconds'):
+        """
+        Returns the histograms in the Prometheus text exposition
+        format.
+        """
+        lines = ['# HELP %s Latency of pyplaybin operations.' % metric, '# TYPE %s histogram' % metric]
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                seen = 0
+                for bound, count in zip(self.BOUND_LABELS, histogram.counts):
+                    seen += count
+                    lines.append('%s_bucket{operation="%s",le="%s"} %d' % (metric, name, bound, seen))
+                lines.append('%s_sum{operation="%s"} %r' % (metric, name, histogram.sum))
+                lines.append('%s_count{operation="%s"} %d' % (metric, name, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+process_metrics = OperationMetrics()
+
+
+class ElementProfile(collections.namedtuple('ElementProfile', ['buffers', 'proctime', 'max_proctime', 'latency', 'max_latency'])):
+    """
+    Profile of an element: number of buffers processed, total and
+    maximum processing time, total and maximum latency, in GStreamer
+    units.
+    """
+
+
+class QueueProfile(collections.namedtuple('QueueProfile', ['samples', 'max_bytes', 'max_buffers', 'max_time', 'avg_bytes'])):
+    """
+    Profile of a queue: number of level samples, maximum bytes,
+    buffers and time queued, and average bytes queued.
+    """
+
+
+class ProfileReport(object):
+    """
+    Result of :func:`Playbin.profile`.
+    """
+
+    def __init__(self):
+        self.elements = dict()
+        """Maps element names to :class:`ElementProfile` objects."""
+        self.queues = dict()
+        """Maps queue names to :class:`QueueProfile` objects."""
+        self.threads = dict()
+        """Maps thread IDs to their average CPU load, from 0.0 to 1.0. This is process-wide."""
+        self.cpuload = None
+        """Average CPU load of the process, from 0.0 to 1.0."""
+
+    def bottleneck(self):
+        """
+        Returns the name of the element with the highest total
+        processing time, or None.
+        """
+        if not self.elements:
+            return None
+        return max(self.elements.items(), key=lambda item: item[1].proctime)[0]
+
+
+class Profiler(object):
+    """
+    Enables GStreamer tracers and collects their records while
+    active. Tracers are created on first use and stay hooked for the
+    rest of the process (GStreamer cannot unregister them), but their
+    records are only collected between :func:`start` and :func:`stop`.
+    Likewise, a single log function is installed on first use and
+    dispatches the records to the active profilers. Note that GStreamer's default log handler prints the records too,
+    unless GST_DEBUG_FILE redirects them.
+    """
+
+    TRACERS = {
+        'latency': 'flags=pipeline+element',
+    }
+    _tracers = dict()
+    _active = set()
+    _active_lock = threading.Lock()
+    _hooked = False
+
+    def __init__(self, tracers=('latency', 'proctime', 'queuelevels', 'rusage'), elements=None):
+        self._names = tracers
+        self._elements = elements
+        self._records = []
+        self.report = ProfileReport()
+
+    @classmethod
+    def _ensure_tracer(cls, name):
+        if name in cls._tracers:
+            return
+        factory = Gst.Registry.get().find_feature(name, Gst.TracerFactory)
+        if factory is None:
+            raise PlaybinError('Unknown tracer %s' % name)
+        factory = factory.load()
+        params = cls.TRACERS.get(name)
+        if params is None:
+            cls._tracers[name] = GObject.new(factory.get_tracer_type())
+        else:
+            cls._tracers[name] = GObject.new(factory.get_tracer_type(), params=params)
+
+    @classmethod
+    def _log(cls, category, level, filename, function, line, obj, message, *args):
+        # Removing a log function needs the closure it was added with,
+        # which PyGObject does not give back: it stays installed.
+        if category.get_name() == 'GST_TRACER' and cls._active:
+            record = message.get()
+            with cls._active_lock:
+                profilers = list(cls._active)
+            for profiler in profilers:
+                profiler._records.append(record)
+
+    def start(self):
+        for name in self._names:
+            self._ensure_tracer(name)
+        with Profiler._active_lock:
+            if not Profiler._hooked:
+                Gst.debug_add_log_function(Profiler._log, None)
+                Profiler._hooked = True
+            Profiler._active.add(self)
+        Gst.debug_set_threshold_for_name('GST_TRACER', Gst.DebugLevel.TRACE)
+
+    def stop(self):
+        with Profiler._active_lock:
+            Profiler._active.discard(self)
+            last = not Profiler._active
+        if last:
+            Gst.debug_unset_threshold_for_name('GST_TRACER')
+        self._parse()
+
+    def _parse(self):
+        elements = collections.defaultdict(lambda: [0, 0, 0, 0, 0])
+        queues = collections.defaultdict(lambda: [0, 0, 0, 0, 0])
+        report = self.report
+        for record in self._records:
+            structure = Gst.Structure.from_string(record)[0]
+            if structure is None:
+                continue
+            kind = structure.get_name()
+            if kind in ('proctime', 'element-latency'):
+                name = structure.get_string('element')
+                if self._elements is not None and name not in self._elements:
+                    continue
+                value = structure.get_uint64('time')[1]
+                stats = elements[name]
+                if kind == 'proctime':
+                    stats[0] += 1
+                    stats[1] += value
+                    stats[2] = max(stats[2], value)
+                else:
+                    stats[3] += value
+                    stats[4] = max(stats[4], value)
+            elif kind == 'queue-level':
+                name = structure.get_string('element')
+                if self._elements is not None and name not in self._elements:
+                    continue
+                stats = queues[name]
+                size = structure.get_uint('size-bytes')[1]
+                stats[0] += 1
+                stats[1] = max(stats[1], size)
+                stats[2] = max(stats[2], structure.get_uint('size-buffers')[1])
+                stats[3] = max(stats[3], structure.get_uint64('size-time')[1])
+                stats[4] += size
+            elif kind == 'thread-rusage':
+                report.threads[structure.get_uint64('thread-id')[1]] = structure.get_uint('average-cpuload')[1] / 1000.0
+            elif kind == 'proc-rusage':
+                report.cpuload = structure.get_uint('average-cpuload')[1] / 1000.0
+        for name, stats in elements.items():
+            report.elements[name] = ElementProfile(*stats)
+        for name, stats in queues.items():
+            report.queues[name] = QueueProfile(stats[0], stats[1], stats[2], stats[3], stats[4] / stats[0])
+        self._records = []
+
+
+class _Operations(object):
+    """
+    Registry of the pending asynchronous operations of a pipeline.
+    Event operations (seeks, steps) are keyed by the seqnum of their
+    event, which GStreamer copies to the resulting ASYNC_DONE
+    message; state changes are keyed by their target state and
+    resolved from the pipeline's STATE_CHANGED messages. Operations
+    are registered from the asyncio loop and resolved from the bus
+    thread, under a lock.
+    """
+
+    def __init__(self, loop):
+        self._call_soon = loop.call_soon_threadsafe
+        self._create_future = loop.create_future
+        self._lock = threading.Lock()
+        self._events = collections.OrderedDict()
+        self._states = []
+        self.pipeline = None
+
+    @staticmethod
+    def _set(ft, exc=None):
+        if not ft.done():
+            if exc is None:
+                ft.set_result(None)
+            else:
+                ft.set_exception(exc)
+
+    def expect_event(self, seqnum):
+        ft = self._create_future()
+        with self._lock:
+            self._events[seqnum] = ft
+        return ft
+
+    def expect_state(self, target):
+        """
+        Registers the state change to `target` in progress; must be
+        called after set_state() returned ASYNC. The change may
+        already be complete.
+        """
+        ft = self._create_future()
+        with self._lock:
+            ret, current, pending = self.pipeline.get_state(0)
+            self._states.append((target, ft))
+            self._settle(current, pending)
+        return ft
+
+    def settled(self):
+        """
+        Resolves state changes after a synchronous set_state().
+        """
+        with self._lock:
+            ret, current, pending = self.pipeline.get_state(0)
+            self._settle(current, pending)
+
+    def discard(self, ft):
+        with self._lock:
+            for seqnum, pending in list(self._events.items()):
+                if pending is ft:
+                    del self._events[seqnum]
+            self._states = [(target, pending) for target, pending in self._states if pending is not ft]
+
+    def async_done(self, seqnum):
+        with self._lock:
+            ft = self._events.pop(seqnum, None)
+            if ft is None:
+                # Some elements do not propagate seqnums: fall back to
+                # the oldest event operation, unless the message may
+                # complete a state change (a preroll) instead.
+                if not self._events or self._states:
+                    return
+                ft = self._events.popitem(last=False)[1]
+        self._call_soon(self._set, ft)
+
+    def state_changed(self, current, pending):
+        with self._lock:
+            self._settle(current, pending)
+
+    def _settle(self, current, pending):
+        # Reaching the target of an operation also completes the
+        # operations it superseded.
+        last = len(self._states) - 1
+        for index in range(last, -1, -1):
+            if self._states[index][0] == current and (pending == Gst.State.VOID_PENDING or index < last):
+                for target, ft in self._states[:index + 1]:
+                    self._call_soon(self._set, ft)
+                del self._states[:index + 1]
+                break
+        if pending == Gst.State.VOID_PENDING and current in (Gst.State.NULL, Gst.State.READY):
+            self._fail(PlaybinError('Pipeline stopped'))
+
+    def _fail(self, exc):
+        failed = [ft for target, ft in self._states] + list(self._events.values())
+        self._states = []
+        self._events.clear()
+        for ft in failed:
+            self._call_soon(self._set, ft, exc)
+        return failed
+
+    def fail(self, exc):
+        """
+        Fails all pending operations; returns whether there were any.
+        """
+        with self._lock:
+            return bool(self._fail(exc))
+
+
 def state_change(func):
     """
-    This decorator changes a regular synchronous method that returns a
-    Gst.StateChangeReturn into an asynchronous one which will yield
-    when the state change has actually happened.
+    This decorator changes a regular synchronous method that returns
+    the target Gst.State and the Gst.StateChangeReturn of the state
+    change (see :func:`PipelineBase._set_state`) into an asynchronous
+    one which will yield when the state change has actually happened. The resulting
+    method accepts a `timeout` keyword argument, in seconds. The
+    latency of the operation is recorded in the object's metrics.
     """
+    name = func.__name__.lstrip('_')
+
     @functools.wraps(func)
-    @asyncio.coroutine
-    def wrapper(self, *args, **kwargs):
-        ret = func(self, *args, **kwargs)
+    async def wrapper(self, *args, timeout=None, **kwargs):
+        started = time.perf_counter()
+        target, ret = func(self, *args, **kwargs)
         if ret == Gst.StateChangeReturn.ASYNC:
-            ft = create_future()
-            self._async_response.append(ft)
-            yield from ft
-        elif ret != Gst.StateChangeReturn.SUCCESS:
+            await self._wait(name, self._operations.expect_state(target), timeout)
+        elif ret == Gst.StateChangeReturn.NO_PREROLL:
+            self._live = True
+            self._operations.settled()
+        elif ret == Gst.StateChangeReturn.SUCCESS:
+            self._operations.settled()
+        else:
             raise PlaybinGstError(ret)
+        self.metrics.observe(name, time.perf_counter() - started)
     return wrapper
 
 
 def gst_async(func):
     """
-    This decorator changes a regular synchronous method into an
-    asynchronous one which will yield when the underlying operation
-    has actually completed. The assumption is that the underlying
-    operation will trigger an ASYNC_DONE message.
+    This decorator changes a regular synchronous method that returns
+    an (element, event) tuple into an asynchronous one which sends
+    the event to the element, and will yield when the resulting
+    ASYNC_DONE message, identified by the event's seqnum, is
+    received. The resulting method accepts a `timeout` keyword
+    argument, in seconds. The latency of the operation is recorded
+    in the object's metrics.
     """
+    name = func.__name__.lstrip('_')
+
     @functools.wraps(func)
-    @asyncio.coroutine
-    def wrapper(self, *args, **kwargs):
-        func(self, *args, **kwargs)
-        ft = create_future()
-        self._async_response.append(ft)
-        return (yield from ft)
+    async def wrapper(self, *args, timeout=None, **kwargs):
+        started = time.perf_counter()
+        element, event = func(self, *args, **kwargs)
+        ft = self._operations.expect_event(event.get_seqnum())
+        if not element.send_event(event):
+            self._operations.discard(ft)
+            raise PlaybinError('%s failed' % name.capitalize())
+        result = await self._wait(name, ft, timeout)
+        self.metrics.observe(name, time.perf_counter() - started)
+        return result
     return wrapper
 
 
@@ -118,6 +882,30 @@ class BasePlaybinWrapper(object):
     def seek(self, *args):
         self._element.seek(*args)
 
+    def use_clock(self, clock):
+        self._element.use_clock(clock)
+
+    def set_start_time(self, time):
+        self._element.set_start_time(time)
+
+    def set_base_time(self, time):
+        self._element.set_base_time(time)
+
+    def send_event(self, event):
+        return self._element.send_event(event)
+
+    def get_bus(self):
+        return self._element.get_bus()
+
+    def iterate_recurse(self):
+        return self._element.iterate_recurse()
+
+    def query(self, query):
+        return self._element.query(query)
+
+    def convert_sample(self, caps):
+        return self._element.emit('convert-sample', caps)
+
     def _isEnabled(self, value):
         return (self._element.get_property('flags') & value) != 0
 
@@ -141,6 +929,9 @@ class BasePlaybinWrapper(object):
     def enableSubtitle(self, enabled=True):
         self._enable(4, enabled)
 
+    def enableDownload(self, enabled=True):
+        self._enable(128, enabled)
+
 
 class PlaybinWrapper(BasePlaybinWrapper):
     """
@@ -172,6 +963,10 @@ class PlaybinWrapper(BasePlaybinWrapper):
     def audio_tracks(self):
         return self._audio[:]
 
+    def stream_id(self, trackname, index):
+        pad = self._element.emit('get-%s-pad' % trackname, index)
+        return None if pad is None else pad.get_stream_id()
+
     def _get_audio_track(self):
         if self.isAudioEnabled():
             return self._audio[self._element.get_property('current-audio')]
@@ -197,7 +992,191 @@ class PlaybinWrapper(BasePlaybinWrapper):
 
 
 
-class Playbin(object):
+class PipelineBase(object):
+    """
+    Base class for wrappers around a GStreamer pipeline: binds it to
+    an asyncio loop and resolves pending asynchronous operations from
+    bus messages.
+    """
+
+    def __init__(self, context=None, loop=None):
+        super().__init__()
+
+        self._async_loop = loop or current_loop()
+        self._call_soon = self._async_loop.call_soon_threadsafe
+        self._create_future = self._async_loop.create_future
+        self._context = context
+        self._operations = _Operations(self._async_loop)
+        self._live = False
+        self.metrics = OperationMetrics(process_metrics)
+        """Operation latencies, see :class:`OperationMetrics`."""
+        self.timeout = None
+        """Default timeout of asynchronous operations in seconds, or
+        None to wait forever. Operations that time out raise
+        :class:`PlaybinTimeout`."""
+
+    def call_from_thread(self, callback, *args, **kwargs):
+        if kwargs:
+            callback = functools.partial(callback, **kwargs)
+        self._call_soon(callback, *args)
+
+    async def _wait(self, name, ft, timeout):
+        # Cancelling the caller, or timing out, unregisters the
+        # operation.
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(ft, timeout)
+        except asyncio.TimeoutError:
+            raise PlaybinTimeout('%s timed out after %s seconds' % (name.capitalize(), timeout))
+        finally:
+            self._operations.discard(ft)
+
+    def _set_state(self, state):
+        # For methods decorated with state_change.
+        return state, self._operations.pipeline.set_state(state)
+
+    def _watch_bus(self, pipeline):
+        self._operations.pipeline = pipeline
+        bus = pipeline.get_bus()
+        if self._context is not None:
+            self._context.push_thread_default()
+        try:
+            bus.add_signal_watch()
+        finally:
+            if self._context is not None:
+                self._context.pop_thread_default()
+        bus.connect('message::error', self._error)
+        bus.connect('message::eos', self._EOS)
+        bus.connect('message::async-done', self._async_done)
+        bus.connect('message::state-changed', self._state_changed)
+
+    def end_of_stream(self):
+        """
+        Overload this to be notified on end of stream.
+        """
+
+    def async_error(self, exc):
+        """
+        Override this to be notified when an error occurs during playback.
+        """
+
+    def _error(self, bus, msg):
+        err, dbg = msg.parse_error()
+        if not self._operations.fail(PlaybinError('%s: %s' % (err, dbg))):
+            self.call_from_thread(self.async_error, PlaybinError('Unexpected async error (%s[%s])' % (err, dbg)))
+
+    def _EOS(self, bus, msg):
+        self.call_from_thread(self.end_of_stream)
+
+    def _async_done(self, bus, msg):
+        self._operations.async_done(msg.get_seqnum())
+
+    def _state_changed(self, bus, msg):
+        if msg.src == self._operations.pipeline:
+            old, new, pending = msg.parse_state_changed()
+            self._operations.state_changed(new, pending)
+
+
+class Recorder(PipelineBase):
+    """
+    Records compressed streams tapped from a playing pipeline into a
+    file, without decoding them again. Each stream is pushed from a
+    pad probe into an appsrc followed by a leaky queue, so a slow
+    disk drops data from the recording instead of stalling playback.
+    Recording starts on a video key frame.
+    """
+
+    def __init__(self, filename, pads, mux='matroskamux', max_time=None, context=None, loop=None):
+        super().__init__(context=context, loop=loop)
+        self._pipeline = Gst.Pipeline.new('recorder')
+        self._watch_bus(self._pipeline)
+        self._finished = create_future(self._async_loop)
+        self._lock = threading.Lock()
+        self._base = None
+        self._has_video = False
+        self._probes = []
+
+        muxer = Gst.ElementFactory.make(mux, 'mux')
+        sink = Gst.ElementFactory.make('filesink', 'sink')
+        sink.set_property('location', filename)
+        self._pipeline.add(muxer)
+        self._pipeline.add(sink)
+        muxer.link(sink)
+
+        for pad in pads:
+            caps = pad.get_current_caps()
+            src = Gst.ElementFactory.make('appsrc', None)
+            src.set_property('caps', caps)
+            src.set_property('format', Gst.Format.TIME)
+            src.set_property('is-live', True)
+            src.set_property('block', False)
+            queue = Gst.ElementFactory.make('queue', None)
+            queue.set_property('leaky', 2)
+            queue.set_property('max-size-time', 2 * Gst.SECOND if max_time is None else max_time)
+            queue.set_property('max-size-bytes', 0)
+            queue.set_property('max-size-buffers', 0)
+            self._pipeline.add(src)
+            self._pipeline.add(queue)
+            src.link(queue)
+            if not queue.link(muxer):
+                self._teardown()
+                raise PlaybinError('%s cannot store %s' % (mux, caps.to_string()))
+            video = caps.get_structure(0).get_name().startswith('video/')
+            self._has_video = self._has_video or video
+            self._probes.append((pad, src, video))
+
+    def start(self):
+        if self._pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self._teardown()
+            raise PlaybinGstError(Gst.StateChangeReturn.FAILURE)
+        self._probes = [(pad, src, pad.add_probe(Gst.PadProbeType.BUFFER, self._probe, src, video)) for pad, src, video in self._probes]
+
+    def _probe(self, pad, info, src, video):
+        buf = info.get_buffer()
+        segment = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if segment is None or buf.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        running_time = segment.parse_segment().to_running_time(Gst.Format.TIME, buf.pts)
+        with self._lock:
+            if self._base is None:
+                if self._has_video and (not video or buf.has_flags(Gst.BufferFlags.DELTA_UNIT)):
+                    return Gst.PadProbeReturn.OK
+                self._base = running_time
+            if running_time < self._base:
+                return Gst.PadProbeReturn.OK
+        copy = buf.copy()
+        copy.pts = running_time - self._base
+        copy.dts = Gst.CLOCK_TIME_NONE
+        src.emit('push-buffer', copy)
+        return Gst.PadProbeReturn.OK
+
+    def end_of_stream(self):
+        if not self._finished.done():
+            self._finished.set_result(None)
+
+    def async_error(self, exc):
+        if not self._finished.done():
+            self._finished.set_exception(exc)
+
+    async def stop(self):
+        """
+        **asynchronous**
+        Stops tapping the streams and finalizes the file.
+        """
+        for pad, src, probe in self._probes:
+            pad.remove_probe(probe)
+            src.emit('end-of-stream')
+        try:
+            await self._finished
+        finally:
+            self._teardown()
+
+    def _teardown(self):
+        self._pipeline.set_state(Gst.State.NULL)
+        self._pipeline.get_bus().remove_signal_watch()
+
+
+class Playbin(PipelineBase):
     """
     Wrapper around a GStreamer pipeline based on the playbin element.
     """
@@ -205,27 +1184,73 @@ class Playbin(object):
     glib_loop = None
     glib_thread = None
 
-    def __init__(self, win_id=None):
+    def __init__(self, win_id=None, frame_cache=0, context=None, loop=None, queue_limits=None, memory_budget=None, audio_analysis=False, clock=None, analyzers=()):
         """
         Builds a new GStreamer pipeline. If `win_id` is specified, it
         is used as a window ID to embed the video sink using the
-        GstOverlay interface.
+        GstOverlay interface. If `frame_cache` is not 0, this many
+        recently decoded frames are kept around so that short
+        backward :func:`step` calls do not need to seek.
+        `queue_limits` (a :class:`QueueLimits`) caps the internal
+        queues of the pipeline, and `memory_budget` (a
+        :class:`MemoryBudget`) shares a total size between
+        pipelines; see :attr:`buffered_bytes`. Bus messages
+        are dispatched by the GLib main context `context` (the
+        default one if not specified) and the results delivered to
+        the asyncio loop `loop` (the current one if not specified);
+        see :class:`PipelineManager`. If `audio_analysis` is True,
+        level and spectrum elements are inserted in the audio branch;
+        see :func:`audio_levels` and :func:`spectrum`. If `clock`
+        (a Gst.Clock) is specified, the pipeline always uses it; see
+        :class:`SimulatedClock`. `analyzers` is a list of
+        :class:`DecodeRun` objects fed with the frames decoded for
+        playback, instead of decoding the file again; see
+        :func:`DecodeRun.wait`.
         """
-        super().__init__()
-
-        self._async_loop = asyncio.get_event_loop()
-        self._async_response = []
+        super().__init__(context=context, loop=loop)
+
+        self._frame_cache = FrameCache(frame_cache) if frame_cache else None
+        self._audio_analysis = audio_analysis
+        self._clock = clock
+        self._analyzers = list(analyzers)
+        self._analysis = {}
+        self._analysis_streams = set()
+        self._analysis_lock = threading.Lock()
+        self._step_offset = 0
+        self._target_state = Gst.State.NULL
+        self._buffering_state = Gst.State.NULL
+        self._buffering = 100
+        self._sink_properties = {}
+        self._parsers = []
+        self._recorder = None
+        self._queue_limits = queue_limits or QueueLimits()
+        self._memory_budget = memory_budget
+        # Strong references: PyGObject wrappers would be freed at
+        # once. Elements are dropped when removed from the pipeline.
+        self._elements_lock = threading.Lock()
+        self._queues = set()
+        self._video_sinks = set()
+        self._qos = (0, 1.0, 0, 0)
+        self._first_frame = None
+        self._preroll_started = None
 
         if platform.system() == 'Darwin':
             evt = threading.Event()
             error = [None]
-            GObject.timeout_add(1, self._build, win_id, evt, error)
+            # Built from the loop running our context, which is not
+            # the default one for PipelineManager shards.
+            source = GLib.timeout_source_new(1)
+            source.set_callback(self._build, win_id, evt, error)
+            source.attach(self._context)
             evt.wait()
             if error[0]:
                 raise PlaybinError from error[0]
         else:
             self._build(win_id, None, None)
 
+        if memory_budget is not None:
+            memory_budget.add(self)
+
     @classmethod
     def start_glib_loop(cls):
         """
@@ -233,8 +1258,7 @@ class Playbin(object):
         first. It initializes threads, GStreamer, and starts the GLib
         loop in a separate thread.
         """
-        GObject.threads_init()
-        Gst.init(None)
+        init_gstreamer()
 
         cls.glib_loop = GObject.MainLoop()
         cls.glib_thread = threading.Thread(target=cls.glib_loop.run)
@@ -250,27 +1274,44 @@ class Playbin(object):
         cls.glib_thread.join()
         cls.glib_loop = cls.glib_thread = None
 
-    def call_from_thread(self, callback, *args, **kwargs):
-        self._async_loop.call_soon_threadsafe(functools.partial(callback, *args, **kwargs))
-
     def _build(self, win_id, evt, error):
         try:
             vsink = None
 
             playbin = Gst.ElementFactory.make('playbin', 'playbin')
             self._playbin = PlaybinWrapper(playbin)
+            if self._clock is not None:
+                playbin.use_clock(self._clock)
 
             bus = playbin.get_bus()
-            bus.add_signal_watch()
-            bus.connect('message::error', self._error)
-            bus.connect('message::eos', self._EOS)
-            bus.connect('message::async-done', self._async_done)
+            self._watch_bus(playbin)
+            bus.connect('message::buffering', self._on_buffering)
+            bus.connect('message::qos', self._on_qos)
+            playbin.connect('deep-element-added', self._element_added)
+            playbin.connect('deep-element-removed', self._element_removed)
 
             vsink = self.create_video_sink('videosink')
             asink = self.create_audio_sink('audiosink')
 
             self._playbin.set_property('video-sink', vsink)
             self._playbin.set_property('audio-sink', asink)
+
+            afilter = vfilter = None
+            if self._audio_analysis:
+                afilter = Gst.parse_bin_from_description('level name=level post-messages=false ! spectrum name=spectrum post-messages=false', True)
+                self._analysis = {'level': afilter.get_by_name('level'), 'spectrum': afilter.get_by_name('spectrum')}
+                bus.connect('message::element', self._on_analysis)
+
+            if self._frame_cache is not None:
+                vfilter = Gst.ElementFactory.make('identity', 'framecache')
+                self._frame_cache.attach(vfilter.get_static_pad('src'))
+
+            afilter = self._tap_filter('audiotap', afilter, [analyzer for analyzer in self._analyzers if analyzer._decode_caps.startswith('audio/')])
+            vfilter = self._tap_filter('videotap', vfilter, [analyzer for analyzer in self._analyzers if not analyzer._decode_caps.startswith('audio/')])
+            if afilter is not None:
+                self._playbin.set_property('audio-filter', afilter)
+            if vfilter is not None:
+                self._playbin.set_property('video-filter', vfilter)
         except Exception as exc:
             if error is None:
                 raise
@@ -281,6 +1322,30 @@ class Playbin(object):
         if win_id is not None and vsink is not None:
             vsink.set_window_handle(win_id)
 
+    def _tap_filter(self, name, inline, analyzers):
+        # A tee feeds the analyzers' branches next to the playback
+        # path, which goes through the `inline` filter if any.
+        if not analyzers:
+            return inline
+        tap = Gst.Bin.new(name)
+        tee = Gst.ElementFactory.make('tee', None)
+        queue = Gst.ElementFactory.make('queue', None)
+        tap.add(tee)
+        tap.add(queue)
+        tee.link(queue)
+        last = queue
+        if inline is not None:
+            tap.add(inline)
+            queue.link(inline)
+            last = inline
+        tap.add_pad(Gst.GhostPad.new('sink', tee.get_static_pad('sink')))
+        tap.add_pad(Gst.GhostPad.new('src', last.get_static_pad('src')))
+        for analyzer in analyzers:
+            branch = analyzer._attach(self._async_loop)
+            tap.add(branch)
+            tee.link(branch)
+        return tap
+
     def create_video_sink(self, name):
         """
         Override this to create a custom video sink. Warning: this
@@ -295,51 +1360,394 @@ class Playbin(object):
         """
         return None
 
-    def end_of_stream(self):
+    def buffering_progress(self, percent):
         """
-        Overload this to be notified on end of stream.
+        Override this to be notified of network buffering progress,
+        from 0 to 100.
         """
 
-    def async_error(self, exc):
+    def set_buffering(self, size=None, duration=None, download=None, ring_buffer_size=0, low_watermark=None, high_watermark=None):
         """
-        Override this to be notified when an error occurs during playback.
+        Configures buffering of network streams. `size` (in bytes)
+        and `duration` (in GStreamer units) bound the buffer. If
+        `download` is 'disk', the stream is downloaded to a temporary
+        file; if it is 'ring', it is downloaded into a ring buffer of
+        `ring_buffer_size` bytes, which must then be positive. `low_watermark` and
+        `high_watermark` (from 0.0 to 1.0 of the buffer) control
+        when buffering starts and stops: playback is paused
+        automatically while buffering and resumed afterwards. Call
+        this before :func:`play`.
         """
-
-    @asyncio.coroutine
-    def play(self, filename=None):
+        if download not in (None, 'disk', 'ring'):
+            raise ValueError('Unknown download mode %s' % download)
+        if download == 'ring' and ring_buffer_size <= 0:
+            raise ValueError('A ring buffer download requires a positive ring_buffer_size')
+        if size is not None:
+            self._playbin.set_property('buffer-size', size)
+        if duration is not None:
+            self._playbin.set_property('buffer-duration', duration)
+        self._playbin.enableDownload(download is not None)
+        self._playbin.set_property('ring-buffer-max-size', ring_buffer_size if download == 'ring' else 0)
+        if low_watermark is not None:
+            self._playbin.set_property('low-watermark', low_watermark)
+        if high_watermark is not None:
+            self._playbin.set_property('high-watermark', high_watermark)
+
+    def set_latency(self, latency=None, sync=None, max_lateness=None):
         """
-        **asynchronous**
-        Starts playing. If `filename` is specified, it's loaded and
-        starts from scratch; else the previously loaded file is
-        resumed.
+        Configures playback of live sources. `latency` (in GStreamer
+        units) overrides the pipeline latency. `sync` and
+        `max_lateness` (in GStreamer units, -1 for unlimited) are
+        applied to all sinks; disabling sync renders buffers as soon
+        as they arrive.
         """
-        yield from self._play(filename=filename)
-        if filename is not None:
-            self._playbin.setup()
+        if latency is not None:
+            self._playbin.set_property('latency', latency)
+        if sync is not None:
+            self._sink_properties['sync'] = sync
+        if max_lateness is not None:
+            self._sink_properties['max-lateness'] = max_lateness
+        for name in ('video-sink', 'audio-sink'):
+            sink = self._playbin.get_property(name)
+            if sink is not None:
+                self._configure_sink(sink)
 
-    @state_change
-    def _play(self, filename=None):
-        if filename is not None:
-            self._playbin.enableAudio()
-            self._playbin.enableSubtitle()
-            self._playbin.set_property('uri', 'file://%s' % os.path.abspath(filename))
-        return self._playbin.set_state(Gst.State.PLAYING)
+    @property
+    def live(self):
+        """True if the current source is live (read only)."""
+        if not self._live:
+            query = Gst.Query.new_latency()
+            self._live = self._playbin.query(query) and query.parse_latency()[0]
+        return self._live
 
-    @state_change
-    def pause(self):
+    @property
+    def latency(self):
+        """The current pipeline latency, as a :class:`Latency` (read only)."""
+        query = Gst.Query.new_latency()
+        if not self._playbin.query(query):
+            raise PlaybinError('Cannot get latency')
+        return Latency(*query.parse_latency())
+
+    def _configure_sink(self, sink):
+        if isinstance(sink, Gst.Bin):
+            for child in sink.iterate_sinks():
+                self._configure_sink(child)
+            return
+        for name, value in self._sink_properties.items():
+            if sink.find_property(name) is not None:
+                sink.set_property(name, value)
+
+    def _element_added(self, playbin, bin, element):
+        if not isinstance(element, Gst.Bin) and element.flags & Gst.ElementFlags.SINK:
+            self._configure_sink(element)
+            factory = element.get_factory()
+            if factory is not None and 'Video' in factory.get_klass() and element.find_property('stats') is not None:
+                with self._elements_lock:
+                    self._video_sinks.add(element)
+                if self._first_frame is not None:
+                    self._watch_first_frame(element)
+        if element.find_property('max-size-bytes') is not None:
+            with self._elements_lock:
+                self._queues.add(element)
+            self._apply_queue_limits()
+        factory = element.get_factory()
+        if factory is not None:
+            klass = factory.get_klass()
+            if 'Parser' in klass and ('Video' in klass or 'Audio' in klass):
+                self._parsers.append(element.get_static_pad('src'))
+
+    def _element_removed(self, playbin, bin, element):
+        with self._elements_lock:
+            self._queues.discard(element)
+            self._video_sinks.discard(element)
+
+    def start_recording(self, filename, mux='matroskamux', max_time=None):
         """
-        **asynchronous**
+        Starts recording the currently playing streams into
+        `filename`, using the `mux` muxer. Streams are stored as is,
+        without re-encoding, so the container must support their
+        codecs. Data is dropped from the recording when more than
+        `max_time` (in GStreamer units, 2 seconds by default) is
+        waiting to be written; playback is never affected.
+        """
+        if self._recorder is not None:
+            raise PlaybinError('Already recording')
+        streams = collections.OrderedDict()
+        for pad in self._parsers:
+            if pad.get_current_caps() is not None:
+                streams[pad.get_stream_id()] = pad
+        if not streams:
+            raise PlaybinError('No stream to record')
+        # The recorder tears itself down if it cannot start.
+        recorder = Recorder(filename, streams.values(), mux=mux, max_time=max_time, context=self._context, loop=self._async_loop)
+        recorder.start()
+        self._recorder = recorder
+
+    async def stop_recording(self):
+        """
+        **asynchronous**
+        Stops recording started by :func:`start_recording`, and
+        returns when the file is complete.
+        """
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None:
+            await recorder.stop()
+
+    def _apply_queue_limits(self):
+        with self._elements_lock:
+            queues = list(self._queues)
+        if not queues:
+            return
+        limits = self._queue_limits
+        size = limits.bytes
+        if self._memory_budget is not None:
+            share = self._memory_budget.share() // len(queues)
+            size = share if not size else min(size, share)
+        for queue in queues:
+            for name, value in (('max-size-bytes', size), ('max-size-buffers', limits.buffers), ('max-size-time', limits.time)):
+                if value is not None:
+                    queue.set_property(name, value)
+
+    @property
+    def buffered_bytes(self):
+        """The number of bytes currently held by the pipeline's queues (read only)."""
+        total = 0
+        with self._elements_lock:
+            queues = list(self._queues)
+        for queue in queues:
+            if queue.find_property('current-level-bytes') is not None:
+                total += queue.get_property('current-level-bytes')
+            else:
+                for pad in queue.iterate_sink_pads():
+                    if pad.find_property('current-level-bytes') is not None:
+                        total += pad.get_property('current-level-bytes')
+        return total
+
+    def stats(self):
+        """
+        Returns the current :class:`PlaybackStats`. Frame counters
+        come from the video sinks' statistics when available (summed
+        over the sinks if there are several), else from QoS messages.
+        """
+        jitter, proportion, processed, dropped = self._qos
+        rendered, rate = processed - dropped, 0.0
+        with self._elements_lock:
+            sinks = list(self._video_sinks)
+        if sinks:
+            rendered = dropped = 0
+            for sink in sinks:
+                stats = sink.get_property('stats')
+                rendered += stats.get_uint64('rendered')[1]
+                dropped += stats.get_uint64('dropped')[1]
+                rate += stats.get_double('average-rate')[1]
+        return PlaybackStats(rendered, dropped, jitter, proportion, rate)
+
+    def stats_stream(self, interval=1.0):
+        """
+        Returns a :class:`StatsStream` yielding :func:`stats` every
+        `interval` seconds.
+        """
+        return StatsStream(self, interval)
+
+    def audio_levels(self, interval=0.1, resolution=None, capacity=1024):
+        """
+        Returns an :class:`AnalysisStream` yielding
+        :class:`AudioLevels` batches every `interval` seconds. Levels
+        are measured every `resolution` seconds (defaults to
+        `interval`; the last value applies to all level streams).
+        Requires `audio_analysis` (see :func:`__init__`) and NumPy.
+        """
+        return self._open_analysis('level', interval, resolution, capacity)
+
+    def spectrum(self, interval=0.1, resolution=None, bands=None, threshold=None, capacity=1024):
+        """
+        Returns an :class:`AnalysisStream` yielding
+        :class:`AudioSpectrum` batches every `interval` seconds. A
+        spectrum of `bands` bands (128 by default) is computed every
+        `resolution` seconds, magnitudes being clipped to `threshold`
+        dB (-60 by default); these settings apply to all spectrum
+        streams. Requires `audio_analysis` (see :func:`__init__`) and
+        NumPy.
+        """
+        if 'spectrum' in self._analysis:
+            if bands is not None:
+                self._analysis['spectrum'].set_property('bands', bands)
+            if threshold is not None:
+                self._analysis['spectrum'].set_property('threshold', threshold)
+        return self._open_analysis('spectrum', interval, resolution, capacity)
+
+    def _open_analysis(self, kind, interval, resolution, capacity):
+        require_numpy('audio analysis')
+        element = self._analysis.get(kind)
+        if element is None:
+            raise PlaybinError('Audio analysis is not enabled')
+        element.set_property('interval', int((resolution or interval) * Gst.SECOND))
+        stream = AnalysisStream(self, kind, interval, capacity)
+        with self._analysis_lock:
+            self._analysis_streams.add(stream)
+        element.set_property('post-messages', True)
+        return stream
+
+    def _close_analysis(self, stream):
+        with self._analysis_lock:
+            self._analysis_streams.discard(stream)
+            if not any(other._kind == stream._kind for other in self._analysis_streams):
+                self._analysis[stream._kind].set_property('post-messages', False)
+
+    def _on_analysis(self, bus, msg):
+        structure = msg.get_structure()
+        kind = structure.get_name()
+        if kind not in self._analysis or msg.src != self._analysis[kind]:
+            return
+        with self._analysis_lock:
+            streams = [stream for stream in self._analysis_streams if stream._kind == kind]
+        if not streams:
+            return
+        text = structure.to_string()
+        timestamp = structure.get_clock_time('stream-time')[1]
+        if kind == 'level':
+            row = (timestamp, _parse_analysis(text, 'rms'), _parse_analysis(text, 'peak'), _parse_analysis(text, 'decay'))
+        else:
+            row = (timestamp, _parse_analysis(text, 'magnitude'))
+        for stream in streams:
+            stream._push(row)
+
+    def _analysis_batch(self, kind, rows):
+        # Rows measured before a change of channel or band count are
+        # dropped, so that each batch is rectangular.
+        if kind == 'level':
+            width = len(rows[-1][1]) if rows else 0
+        else:
+            spectrum = self._analysis['spectrum']
+            width = spectrum.get_property('bands')
+        rows = [row for row in rows if len(row[1]) == width]
+        timestamps = numpy.array([row[0] for row in rows], dtype=numpy.uint64)
+        fields = 3 if kind == 'level' else 1
+        columns = [numpy.array([row[1 + index] for row in rows], dtype=numpy.float64).reshape(len(rows), width) for index in range(fields)]
+        if kind == 'level':
+            return AudioLevels(timestamps, *columns)
+        caps = spectrum.get_static_pad('sink').get_current_caps()
+        rate = caps.get_structure(0).get_int('rate')[1] if caps is not None else 0
+        frequencies = (numpy.arange(width) + 0.5) * rate / (2.0 * width)
+        return AudioSpectrum(timestamps, frequencies, columns[0])
+
+    @contextlib.contextmanager
+    def profile(self, tracers=('latency', 'proctime', 'queuelevels', 'rusage')):
+        """
+        Context manager that profiles the pipeline's elements using
+        GStreamer tracers, while the block runs. It yields a
+        :class:`ProfileReport`, filled when the block exits. See
+        :class:`Profiler` for caveats.
+        """
+        profiler = Profiler(tracers)
+        profiler.start()
+        try:
+            yield profiler.report
+        finally:
+            profiler._elements = set(element.get_name() for element in self._playbin.iterate_recurse())
+            profiler.stop()
+
+    @property
+    def recording(self):
+        """True while recording (read only)."""
+        return self._recorder is not None
+
+    @property
+    def buffering(self):
+        """Network buffering progress, from 0 to 100 (read only)."""
+        return self._buffering
+
+    async def play(self, filename=None, timeout=None):
+        """
+        **asynchronous**
+        Starts playing. If `filename` is specified, it's loaded and
+        starts from scratch; else the previously loaded file is
+        resumed. `filename` may be a file name or any URI supported
+        by GStreamer. `timeout` overrides :attr:`timeout`.
+        """
+        if filename is None:
+            await self._play(timeout=timeout)
+        else:
+            await self._open(filename, Gst.State.PLAYING, timeout=timeout)
+            self._playbin.setup()
+
+    async def load(self, filename, timeout=None):
+        """
+        **asynchronous**
+        Loads `filename` like :func:`play`, but only prerolls it:
+        playback stays paused on the first frame.
+        """
+        await self._open(filename, Gst.State.PAUSED, timeout=timeout)
+        self._playbin.setup()
+
+    def _set_state(self, state):
+        self._target_state = self._buffering_state = state
+        if state != Gst.State.PAUSED:
+            # The step offset is relative to the cached frames.
+            self._step_offset = 0
+            if self._frame_cache is not None:
+                self._frame_cache.stop()
+        return state, self._playbin.set_state(state)
+
+    @state_change
+    def _play(self):
+        if self._memory_budget is not None:
+            self._memory_budget.add(self)
+        return self._set_state(Gst.State.PLAYING)
+
+    @state_change
+    def _open(self, filename, state):
+        self._playbin.enableAudio()
+        self._playbin.enableSubtitle()
+        self._playbin.set_property('uri', to_uri(filename))
+        self._buffering = 100
+        self._live = False
+        self._parsers = []
+        self._first_frame = self._preroll_started = time.perf_counter()
+        # Sinks are reused from one file to the next; new ones are
+        # watched as they are added.
+        with self._elements_lock:
+            sinks = list(self._video_sinks)
+        for sink in sinks:
+            self._watch_first_frame(sink)
+        if self._memory_budget is not None:
+            self._memory_budget.add(self)
+        return self._set_state(state)
+
+    def _state_changed(self, bus, msg):
+        super()._state_changed(bus, msg)
+        if msg.src == self._operations.pipeline and msg.parse_state_changed()[1] == Gst.State.PAUSED:
+            started, self._preroll_started = self._preroll_started, None
+            if started is not None:
+                self.call_from_thread(self.metrics.observe, 'preroll', time.perf_counter() - started)
+
+    def _watch_first_frame(self, sink):
+        sink.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self._first_frame_probe)
+
+    def _first_frame_probe(self, pad, info):
+        started, self._first_frame = self._first_frame, None
+        if started is not None:
+            self.call_from_thread(self.metrics.observe, 'first_frame', time.perf_counter() - started)
+        return Gst.PadProbeReturn.REMOVE
+
+    @state_change
+    def pause(self):
+        """
+        **asynchronous**
         Pauses playback.
         """
-        return self._playbin.set_state(Gst.State.PAUSED)
+        return self._set_state(Gst.State.PAUSED)
 
     @state_change
     def stop(self):
         """
         **asynchronous**
-        Stops playback.
+        Stops playback. This also releases the pipeline's share of
+        its :class:`MemoryBudget`, until the next :func:`play`.
         """
-        return self._playbin.set_state(Gst.State.NULL)
+        if self._memory_budget is not None:
+            self._memory_budget.remove(self)
+        return self._set_state(Gst.State.NULL)
 
     @property
     def position(self):
@@ -358,25 +1766,84 @@ class Playbin(object):
         return dur
 
     @gst_async
-    def seek(self, position):
+    def seek(self, position, accurate=False):
         """
         **asynchronous**
-        Seek to specified position, in GStreamer units.
+        Seek to specified position, in GStreamer units. By default
+        this seeks to the nearest key frame; if `accurate` is True,
+        the exact position is reached at the cost of decoding from
+        the previous key frame.
         """
-        self._playbin.seek(1.0, Gst.Format.TIME, Gst.SeekFlags.FLUSH|Gst.SeekFlags.KEY_UNIT, Gst.SeekType.SET, position, Gst.SeekType.NONE, -1)
+        self._step_offset = 0
+        flags = Gst.SeekFlags.FLUSH|(Gst.SeekFlags.ACCURATE if accurate else Gst.SeekFlags.KEY_UNIT)
+        return self._playbin, Gst.Event.new_seek(1.0, Gst.Format.TIME, flags, Gst.SeekType.SET, position, Gst.SeekType.NONE, -1)
+
+    @gst_async
+    def _step(self, count):
+        sink = self._playbin.get_property('video-sink')
+        if sink is None:
+            raise PlaybinError('No video sink')
+        return sink, Gst.Event.new_step(Gst.Format.BUFFERS, count, 1.0, True, False)
 
-    @asyncio.coroutine
-    def rewind(self, duration):
+    async def step(self, count=1, format='raw'):
+        """
+        **asynchronous**
+        Steps `count` frames forward, or backward if `count` is
+        negative. The pipeline must be paused. Backward steps are
+        served from the frame cache (see :func:`__init__`) when
+        possible, without touching the pipeline; otherwise an
+        accurate seek is performed. Returns the new current frame as
+        a :class:`VideoFrame` in the specified `format` (see
+        :func:`snapshot`).
+
+        A backward step served from the cache changes neither what
+        the video sink displays nor :attr:`position`: callers must
+        draw the returned frame themselves. The cache captures frames
+        from the first step after pausing until playback resumes.
+        """
+        sample = self._playbin.get_property('sample')
+        if sample is None:
+            raise PlaybinError('No video frame available')
+        if self._frame_cache is not None:
+            self._frame_cache.start(sample)
+        history = [] if self._frame_cache is None else self._frame_cache.history(sample.get_buffer().pts)
+        if not history:
+            self._step_offset = 0
+            history = [sample]
+
+        offset = self._step_offset - count
+        if offset < 0:
+            self._step_offset = 0
+            await self._step(-offset)
+            sample = self._playbin.get_property('sample')
+        elif offset < len(history):
+            self._step_offset = offset
+            sample = history[-1 - offset]
+        else:
+            caps = sample.get_caps().get_structure(0)
+            ok, num, denom = caps.get_fraction('framerate')
+            if ok and num:
+                frame_duration = Gst.SECOND * denom // num
+            else:
+                frame_duration = sample.get_buffer().duration
+            await self.seek(max(0, sample.get_buffer().pts - offset * frame_duration), accurate=True)
+            sample = self._playbin.get_property('sample')
+
+        caps = frame_caps(format)
+        def convert():
+            return VideoFrame.from_sample(GstVideo.video_convert_sample(sample, caps, Gst.CLOCK_TIME_NONE))
+        return await self._async_loop.run_in_executor(None, convert)
+
+    async def rewind(self, duration):
         """
         **asynchronous**
         Rewind by specified duration, in seconds.
         """
         pos = self.position
         pos -= duration * Gst.SECOND
-        yield from self.seek(max(0, pos))
+        await self.seek(max(0, pos))
 
-    @asyncio.coroutine
-    def forward(self, duration):
+    async def forward(self, duration):
         """
         **asynchronous**
         Forward by specified duration, in seconds.
@@ -384,7 +1851,34 @@ class Playbin(object):
         pos = self.position
         dur = self.duration
         pos += duration * Gst.SECOND
-        yield from self.seek(min(dur, pos))
+        await self.seek(min(dur, pos))
+
+    async def snapshot(self, format='image/png', width=None):
+        """
+        **asynchronous**
+        Grabs the currently displayed video frame, without touching
+        the video sink. `format` is either 'raw' (packed RGB) or an
+        image media type like 'image/png'. If `width` is specified,
+        the frame is scaled to this width, keeping its aspect
+        ratio. Conversion happens in a worker thread. Returns a
+        :class:`VideoFrame`.
+        """
+        sample = self._playbin.get_property('sample')
+        if sample is None:
+            raise PlaybinError('No video frame available')
+        height = None
+        if width is not None:
+            caps = sample.get_caps().get_structure(0)
+            src_width, src_height = caps.get_int('width')[1], caps.get_int('height')[1]
+            height = max(2, (src_height * width // src_width) & ~1)
+        caps = frame_caps(format, width, height)
+
+        def convert():
+            converted = self._playbin.convert_sample(caps)
+            if converted is None:
+                raise PlaybinError('Cannot convert frame to %s' % caps.to_string())
+            return VideoFrame.from_sample(converted)
+        return await self._async_loop.run_in_executor(None, convert)
 
     def _get_subtitle(self):
         return self._playbin.subtitle
@@ -394,11 +1888,13 @@ class Playbin(object):
 
     def _get_subtitle_file(self):
         uri = self._playbin.get_property('suburi')
-        return None if uri is None else uri[7:]
+        if uri is not None and uri.startswith('file://'):
+            return Gst.filename_from_uri(uri)[0]
+        return uri
     def _set_subtitle_file(self, filename):
         self._playbin.enableSubtitle()
-        self._playbin.set_property('suburi', 'file://%s' % os.path.abspath(filename))
-    subtitle_file = property(_get_subtitle_file, _set_subtitle_file, doc="""Subtitle file name (read/write).""")
+        self._playbin.set_property('suburi', to_uri(filename))
+    subtitle_file = property(_get_subtitle_file, _set_subtitle_file, doc="""Subtitle file name or URI (read/write).""")
 
     def _get_audio_track(self):
         return self._playbin.audio_track
@@ -418,28 +1914,1934 @@ class Playbin(object):
         """
         return self._playbin.audio_tracks()
 
+    async def extract_cues(self, track=None, cache_dir=None):
+        """
+        **asynchronous**
+        Extracts all the cues of a subtitle track in a separate
+        pipeline and returns them as a :class:`CueIndex`. Uses
+        :attr:`subtitle_file` if set, otherwise `track` (a
+        :class:`StreamTrack` or an index) of the current media,
+        defaulting to the current subtitle track. The track is looked
+        up by stream-id, since the order of the subtitle streams may
+        differ between pipelines.
+        """
+        filename = self.subtitle_file
+        stream = 0
+        if filename is None:
+            filename = self._playbin.get_property('uri')
+            if filename is None:
+                raise PlaybinError('No media')
+            if track is None:
+                track = self.subtitle
+            if isinstance(track, StreamTrack):
+                track = track.index
+            stream = track or 0
+            stream_id = self._playbin.stream_id('text', stream)
+            if stream_id is not None:
+                stream = stream_id
+        cues = await SubtitleExtractor(filename, cache_dir=cache_dir, stream=stream).run()
+        return CueIndex(Cue(*cue) for cue in cues)
+
     def _get_volume(self):
         return self._playbin.get_property('volume')
     def _set_volume(self, value):
         self._playbin.set_property('volume', value)
     volume = property(_get_volume, _set_volume, doc="Sound volume, from 0.0 to 1.0 (read/write).")
 
-    def _error(self, bus, msg):
-        err, dbg = msg.parse_error()
+    def _on_qos(self, bus, msg):
+        if self._video_sinks and msg.src not in self._video_sinks:
+            return
+        jitter, proportion, quality = msg.parse_qos_values()
+        fmt, processed, dropped = msg.parse_qos_stats()
+        if fmt == Gst.Format.BUFFERS:
+            self._qos = (jitter, proportion, processed, dropped)
+        else:
+            self._qos = (jitter, proportion) + self._qos[2:]
+
+    def _on_buffering(self, bus, msg):
+        self._buffering = msg.parse_buffering()
+        self.call_from_thread(self.buffering_progress, self._buffering)
+        if self._live or self._target_state != Gst.State.PLAYING:
+            return
+        # Only transitions are applied: the state changes registered
+        # by play() complete through STATE_CHANGED messages.
+        state = Gst.State.PLAYING if self._buffering == 100 else Gst.State.PAUSED
+        if state != self._buffering_state:
+            self._buffering_state = state
+            self._playbin.set_state(state)
+
+
+
+class PlaybinGroup(object):
+    """
+    Plays several :class:`Playbin` instances in sync, frame-locked:
+    they share one clock and one base time, and their latency is
+    aligned, so their outputs match to within the sinks' own
+    accuracy. Once grouped, the players must be controlled through
+    the group only. `clock` defaults to the system clock. If
+    `provide` is an (address, port) tuple, the group clock is
+    published there with a network time provider; if `network_clock`
+    is an (address, port) tuple, the group follows the clock
+    published there instead. Groups in several processes sharing a
+    clock this way play in sync when started with the same base time
+    (see :func:`play`). The network clock requires GstNet.
+    """
+
+    def __init__(self, players, clock=None, provide=None, network_clock=None, margin=0.1):
+        self.players = list(players)
+        """The grouped :class:`Playbin` objects."""
+        if network_clock is not None:
+            address, port = network_clock
+            clock = require_typelib('GstNet', 'network clocks').NetClientClock.new('pyplaybin', address, port, 0)
+            if not clock.wait_for_sync(5 * Gst.SECOND):
+                raise PlaybinError('Cannot synchronize with %s:%d' % (address, port))
+        self.clock = clock or Gst.SystemClock.obtain()
+        """The group clock."""
+        self._provider = None
+        if provide is not None:
+            address, port = provide
+            self._provider = require_typelib('GstNet', 'network clocks').NetTimeProvider.new(self.clock, address, port)
+        self._margin = int(margin * Gst.SECOND)
+        self._running_time = 0
+        self.base_time = None
+        """Base time of the group while playing, in clock time; None
+        otherwise."""
+        # With no start time, pipelines keep the base time they are
+        # given instead of picking their own when going to PLAYING.
+        for player in self.players:
+            player._playbin.use_clock(self.clock)
+            player._playbin.set_start_time(Gst.CLOCK_TIME_NONE)
+
+    async def load(self, filenames):
+        """
+        **asynchronous**
+        Loads one file per player (see :func:`Playbin.load`).
+        """
+        self._running_time = 0
+        self.base_time = None
+        await asyncio.gather(*[player.load(filename) for player, filename in zip(self.players, filenames)])
+
+    async def play(self, base_time=None):
+        """
+        **asynchronous**
+        Starts all players together, `margin` seconds (see
+        :func:`__init__`) after the call, or at `base_time` (in clock
+        time) to join another group. Returns the base time used.
+        """
+        if self.base_time is not None:
+            return self.base_time
+        await asyncio.gather(*[player.pause() for player in self.players])
+        latencies = []
+        for player in self.players:
+            try:
+                latencies.append(player.latency.min)
+            except PlaybinError:
+                pass
+        if latencies:
+            for player in self.players:
+                player.set_latency(latency=max(latencies))
+        if base_time is None:
+            base_time = self.clock.get_time() + self._margin - self._running_time
+        for player in self.players:
+            player._playbin.set_base_time(base_time)
+        self.base_time = base_time
+        await asyncio.gather(*[player.play() for player in self.players])
+        return base_time
+
+    async def pause(self):
+        """
+        **asynchronous**
+        Pauses all players.
+        """
+        if self.base_time is not None:
+            self._running_time = max(0, self.clock.get_time() - self.base_time)
+            self.base_time = None
+        await asyncio.gather(*[player.pause() for player in self.players])
+
+    async def seek(self, position, accurate=False):
+        """
+        **asynchronous**
+        Seeks all players to `position`, in GStreamer units (see
+        :func:`Playbin.seek`), and resumes them together if they were
+        playing.
+        """
+        playing = self.base_time is not None
+        if playing:
+            await self.pause()
+        await asyncio.gather(*[player.seek(position, accurate=accurate) for player in self.players])
+        # Flushing seeks restart the running time from zero.
+        self._running_time = 0
+        if playing:
+            await self.play()
+
+    async def stop(self):
+        """
+        **asynchronous**
+        Stops all players.
+        """
+        self._running_time = 0
+        self.base_time = None
+        await asyncio.gather(*[player.stop() for player in self.players])
+
+    @property
+    def position(self):
+        """Stream position of the first player, in GStreamer units (read only)."""
+        return self.players[0].position
+
+
+class SimulatedClock(object):
+    """
+    Virtual time for simulations and tests: a GstTestClock, driven by
+    a background thread which, whenever an element waits on the
+    clock, jumps straight to the time it waits for. Pipelines using
+    :attr:`clock` (see :func:`Playbin.__init__`) thus run as fast as
+    the CPU allows, while keeping their timing semantics:
+    synchronization between streams, live latency, positions and
+    end of stream all follow virtual time. Sinks must render through
+    the clock (fake sinks and app sinks do; audio devices consume
+    data in real time). Use as a context manager, or call
+    :func:`start` and :func:`stop`. Requires the GstCheck typelib.
+    """
+
+    IDLE = 0.001
+
+    def __init__(self, start=0):
+        self.clock = require_typelib('GstCheck', 'simulated clocks').TestClock.new_with_start_time(start)
+        """The Gst.Clock to use in pipelines."""
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def time(self):
+        """The current virtual time, in GStreamer units (read only)."""
+        return self.clock.get_time()
+
+    def advance(self, delta):
+        """
+        Advances the virtual time by `delta` GStreamer units, for
+        manual control when the clock is not started.
+        """
+        self.clock.advance_time(delta)
+
+    def start(self):
+        """
+        Starts driving the clock.
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='pyplaybin-simulated-clock', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops driving the clock; waiting elements block until it is
+        started again or advanced.
+        """
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        clock = self.clock
+        while not self._stopped.is_set():
+            ok, clock_id = clock.peek_next_pending_id()
+            if not ok:
+                # Nothing waits, e.g. paused pipelines; poll.
+                self._stopped.wait(self.IDLE)
+                continue
+            target = Gst.Clock.id_get_time(clock_id)
+            if target > clock.get_time():
+                clock.set_time(target)
+            clock.process_next_clock_id()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class ShardStats(collections.namedtuple('ShardStats', ['index', 'pipelines', 'messages'])):
+    """
+    Statistics for a :class:`PipelineManager` shard: number of
+    pipelines it hosts and number of bus messages it dispatched.
+    """
+
+
+class PipelineShard(object):
+    """
+    A GLib main context running in its own thread, optionally with
+    its own asyncio loop in another thread.
+    """
+
+    def __init__(self, index, with_loop=False):
+        self.index = index
+        self.pipelines = 0
+        self.messages = 0
+        self.context = GLib.MainContext()
+        self.loop = asyncio.new_event_loop() if with_loop else None
+        self._glib_loop = GLib.MainLoop(self.context)
+        self._threads = [threading.Thread(target=self._glib_loop.run, name='pyplaybin-glib-%d' % index)]
+        if with_loop:
+            self._threads.append(threading.Thread(target=self._run_loop, name='pyplaybin-asyncio-%d' % index))
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._glib_loop.quit()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        for thread in self._threads:
+            thread.join()
+        if self.loop is not None:
+            self.loop.close()
+
+    def count_message(self, bus, msg):
+        self.messages += 1
+
+    def stats(self):
+        return ShardStats(self.index, self.pipelines, self.messages)
+
+
+class PipelineManager(object):
+    """
+    Spreads pipelines across `shards` GLib main contexts, each
+    dispatched by its own thread, instead of the single loop started
+    by :func:`Playbin.start_glib_loop`. If `loops` is True, each shard
+    also gets its own asyncio loop running in a separate thread;
+    coroutines of a pipeline must then be run on its loop, see
+    :func:`run`.
+    """
+
+    def __init__(self, shards=None, loops=False):
+        self._shards = [PipelineShard(index, with_loop=loops) for index in range(shards or os.cpu_count() or 1)]
+        self._players = dict()
+
+    def start(self):
+        """
+        Initializes GStreamer and starts the shards' threads.
+        """
+        init_gstreamer()
+        for shard in self._shards:
+            shard.start()
+
+    def stop(self):
+        """
+        Stops and joins the shards' threads.
+        """
+        for shard in self._shards:
+            shard.stop()
+
+    def create(self, cls=Playbin, *args, **kwargs):
+        """
+        Builds a new pipeline of class `cls` (a :class:`Playbin`
+        subclass) on the least loaded shard. Additional arguments are
+        passed to the constructor.
+        """
+        shard = min(self._shards, key=lambda shard: shard.pipelines)
+        player = cls(*args, context=shard.context, loop=shard.loop, **kwargs)
+        handler = player._playbin.get_bus().connect('message', shard.count_message)
+        self._players[id(player)] = (shard, handler)
+        shard.pipelines += 1
+        return player
+
+    def release(self, player):
+        """
+        Forgets about a pipeline built by :func:`create`. It should
+        be stopped first.
+        """
+        shard, handler = self._players.pop(id(player))
+        player._playbin.get_bus().disconnect(handler)
+        shard.pipelines -= 1
+
+    def run(self, player, coro):
+        """
+        Schedules coroutine `coro` (e.g. `player.play(filename)`) on
+        the asyncio loop of `player`'s shard, and returns an awaitable
+        for the current loop. Without per-shard loops, `coro` is
+        returned unchanged.
+        """
+        shard, handler = self._players[id(player)]
+        if shard.loop is None:
+            return coro
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, shard.loop))
+
+    def stats(self):
+        """
+        Returns a list of :class:`ShardStats`, one per shard.
+        """
+        return [shard.stats() for shard in self._shards]
+
+
+class PlaybinWorker(Playbin):
+    """
+    The :class:`Playbin` running in a :class:`PlaybinProcess` worker;
+    it executes requests received on `conn`, copies decoded frames
+    into the shared memory segment `shm_name` if specified, and
+    hands them to `frame_callback` if specified.
+    """
+
+    def __init__(self, conn, shm_name, slots, slot_size, frame_callback=None):
+        super().__init__()
+        self._conn = conn
+        self._lock = threading.Lock()
+        self._shm = None
+        self._slot_size = slot_size
+        self._free = collections.deque(range(slots))
+        self._frame_callback = frame_callback
+        if shm_name is not None:
+            from multiprocessing import shared_memory
+            self._shm = shared_memory.SharedMemory(name=shm_name)
+        if shm_name is not None or frame_callback is not None:
+            tap = Gst.ElementFactory.make('identity', 'frametap')
+            tap.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._probe)
+            self._playbin.set_property('video-filter', tap)
+
+    def _send(self, msg):
+        with self._lock:
+            self._conn.send(msg)
+
+    def end_of_stream(self):
+        self._send(('eos',))
+
+    def async_error(self, exc):
+        self._send(('error', str(exc)))
+
+    def _probe(self, pad, info):
+        buf = info.get_buffer()
+        if self._frame_callback is not None:
+            self._process(pad, buf)
+        if self._shm is not None:
+            self._copy(pad, buf)
+        return Gst.PadProbeReturn.OK
+
+    def _process(self, pad, buf):
+        frame = VideoFrame.from_sample(Gst.Sample.new(buf, pad.get_current_caps(), None, None))
+        try:
+            result = self._frame_callback(frame)
+        except Exception as exc:
+            self._send(('error', 'Frame callback failed: %s' % exc))
+            return
+        if result is not None:
+            self._send(('processed', result))
+
+    def _copy(self, pad, buf):
+        size = buf.get_size()
         try:
-            ft = self._async_response.pop(0)
+            slot = self._free.popleft()
         except IndexError:
-            self.call_from_thread(self.async_error, PlaybinError('Unexpected async error (%s[%s])' % (err, dbg)))
+            return
+        if size > self._slot_size:
+            self._free.append(slot)
+            return
+        offset = slot * self._slot_size
+        self._shm.buf[offset:offset + size] = buf.extract_dup(0, size)
+        caps = pad.get_current_caps().get_structure(0)
+        self._send(('frame', slot, size, caps.get_string('format'), caps.get_int('width')[1], caps.get_int('height')[1], buf.pts))
+
+    def dispatch(self):
+        while self._conn.poll():
+            try:
+                msg = self._conn.recv()
+            except EOFError:
+                self._async_loop.stop()
+                return
+            kind = msg[0]
+            if kind == 'call':
+                ident, name, args = msg[1:]
+                task = self._async_loop.create_task(getattr(self, name)(*args))
+                task.add_done_callback(functools.partial(self._reply, ident))
+            elif kind == 'get':
+                ident, name = msg[1:]
+                try:
+                    value = getattr(self, name)
+                    if callable(value):
+                        value = value()
+                except Exception as exc:
+                    self._send(('error', ident, str(exc)))
+                else:
+                    self._send(('result', ident, value))
+            elif kind == 'set':
+                setattr(self, msg[1], msg[2])
+            elif kind == 'release':
+                self._free.append(msg[1])
+            elif kind == 'quit':
+                self._async_loop.stop()
+
+    def _reply(self, ident, task):
+        if task.exception() is None:
+            self._send(('result', ident, task.result()))
         else:
-            self._async_loop.call_soon_threadsafe(ft.set_exception, PlaybinError('%s: %s' % (err, dbg)))
+            self._send(('error', ident, str(task.exception())))
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+
+
+def _playbin_worker(conn, shm_name, slots, slot_size, frame_callback):
+    Playbin.start_glib_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        worker = PlaybinWorker(conn, shm_name, slots, slot_size, frame_callback)
+        loop.add_reader(conn.fileno(), worker.dispatch)
+        loop.run_forever()
+        loop.run_until_complete(worker.stop())
+        worker.close()
+    finally:
+        loop.close()
+        Playbin.stop_glib_loop()
+
+
+def _proxy_call(name):
+    async def method(self, *args):
+        return await self._call(name, *args)
+    method.__name__ = name
+    method.__doc__ = '**asynchronous** See :func:`Playbin.%s`.' % name
+    return method
+
+
+def _proxy_property(name):
+    def getter(self):
+        return self._get(name)
+    def setter(self, value):
+        self._send(('set', name, value))
+    return property(getter, setter, doc='See :attr:`Playbin.%s`.' % name)
+
+
+class PlaybinProcess(object):
+    """
+    Proxy for a :class:`Playbin` running in a worker process, so that
+    a crashing element cannot take the application down. The API
+    mirrors :class:`Playbin`. Reading properties is a synchronous
+    round trip to the worker, which blocks the asyncio loop for at
+    most :attr:`timeout` seconds; messages received meanwhile are
+    dispatched, so :func:`new_frame` and the other callbacks may run
+    from within a property read.
+
+    If `frames` is True, decoded video frames are copied into a
+    shared memory ring buffer of `slots` slots of `slot_size` bytes
+    each, and handed to :func:`new_frame` without pickling. Frames
+    are dropped while all slots are in use. :func:`new_frame` runs
+    in this process; to process frames in the worker instead, and so
+    spread the work over several interpreters, pass a picklable
+    `frame_callback` (such as a module-level function). It is called
+    with each :class:`VideoFrame` from the worker's streaming thread,
+    and what it returns, unless None, is pickled back to
+    :func:`frame_processed`.
+    """
+
+    def __init__(self, frames=False, slots=4, slot_size=1920 * 1080 * 4, frame_callback=None):
+        self._async_loop = current_loop()
+        self._slot_size = slot_size
+        self._pending = dict()
+        self._next_ident = 0
+        self.timeout = 5.0
+        """Timeout of property reads in seconds; reading a property
+        of a hung worker raises :class:`PlaybinTimeout`."""
+        self._shm = None
+        if frames:
+            from multiprocessing import shared_memory
+            self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child = ctx.Pipe()
+        self._process = ctx.Process(target=_playbin_worker, args=(child, None if self._shm is None else self._shm.name, slots, slot_size, frame_callback), daemon=True)
+        self._process.start()
+        child.close()
+        self._async_loop.add_reader(self._conn.fileno(), self._dispatch)
+
+    def end_of_stream(self):
+        """
+        Overload this to be notified on end of stream.
+        """
+
+    def async_error(self, exc):
+        """
+        Override this to be notified when an error occurs during
+        playback, or when the worker process dies.
+        """
+
+    def new_frame(self, frame):
+        """
+        Override this to process decoded frames. `frame` is a
+        :class:`VideoFrame` whose `data` is a memoryview into shared
+        memory; it is only valid until this method returns.
+        """
+
+    def frame_processed(self, result):
+        """
+        Override this to receive the results of `frame_callback`.
+        """
+
+    async def close(self):
+        """
+        **asynchronous**
+        Stops playback and terminates the worker process.
+        """
+        if not self._conn.closed:
+            self._async_loop.remove_reader(self._conn.fileno())
+            if self._process.is_alive():
+                self._conn.send(('quit',))
+                await self._async_loop.run_in_executor(None, self._process.join)
+            self._conn.close()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+
+    def _send(self, msg):
+        if self._conn.closed:
+            raise PlaybinError('Worker process died')
+        self._conn.send(msg)
+
+    def _request(self, kind, *args):
+        ident = self._next_ident
+        self._next_ident += 1
+        ft = create_future(self._async_loop)
+        self._send((kind, ident) + args)
+        self._pending[ident] = ft
+        return ft
+
+    def _call(self, name, *args):
+        return self._request('call', name, args)
+
+    def _get(self, name):
+        ft = self._request('get', name)
+        deadline = time.monotonic() + self.timeout
+        while not ft.done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._conn.poll(remaining):
+                # A late reply finds no pending request and is dropped.
+                self._pending = {ident: pending for ident, pending in self._pending.items() if pending is not ft}
+                ft.cancel()
+                raise PlaybinTimeout('Reading %s timed out after %s seconds' % (name, self.timeout))
+            self._handle(self._recv())
+        return ft.result()
+
+    def _recv(self):
+        try:
+            return self._conn.recv()
+        except (EOFError, OSError):
+            return ('died',)
+
+    def _dispatch(self):
+        while not self._conn.closed and self._conn.poll():
+            self._handle(self._recv())
+
+    def _handle(self, msg):
+        kind = msg[0]
+        if kind == 'result':
+            ft = self._pending.pop(msg[1], None)
+            if ft is not None and not ft.done():
+                ft.set_result(msg[2])
+        elif kind == 'error' and len(msg) == 3:
+            ft = self._pending.pop(msg[1], None)
+            if ft is not None and not ft.done():
+                ft.set_exception(PlaybinError(msg[2]))
+        elif kind == 'error':
+            self.async_error(PlaybinError(msg[1]))
+        elif kind == 'eos':
+            self.end_of_stream()
+        elif kind == 'processed':
+            self.frame_processed(msg[1])
+        elif kind == 'frame':
+            slot, size = msg[1:3]
+            offset = slot * self._slot_size
+            data = self._shm.buf[offset:offset + size]
+            try:
+                self.new_frame(VideoFrame(data, *msg[3:]))
+            finally:
+                data.release()
+                if not self._conn.closed:
+                    self._conn.send(('release', slot))
+        elif kind == 'died':
+            # A dead peer stays readable, every recv() raising EOF:
+            # closing the connection ends the dispatch loops.
+            if self._conn.closed:
+                return
+            self._async_loop.remove_reader(self._conn.fileno())
+            self._conn.close()
+            exc = PlaybinError('Worker process died')
+            pending, self._pending = self._pending, dict()
+            for ft in pending.values():
+                if not ft.done():
+                    ft.set_exception(exc)
+            self.async_error(exc)
+
+    play = _proxy_call('play')
+    pause = _proxy_call('pause')
+    stop = _proxy_call('stop')
+    seek = _proxy_call('seek')
+    rewind = _proxy_call('rewind')
+    forward = _proxy_call('forward')
+
+    position = _proxy_property('position')
+    duration = _proxy_property('duration')
+    subtitle = _proxy_property('subtitle')
+    subtitle_file = _proxy_property('subtitle_file')
+    audio_track = _proxy_property('audio_track')
+    volume = _proxy_property('volume')
+
+    def subtitle_tracks(self):
+        """
+        See :func:`Playbin.subtitle_tracks`.
+        """
+        return self._get('subtitle_tracks')
+
+    def audio_tracks(self):
+        """
+        See :func:`Playbin.audio_tracks`.
+        """
+        return self._get('audio_tracks')
+
+
+class MosaicTile(object):
+    """
+    A tile of a :class:`Mosaic`. Each tile has its own decoder, and
+    can be sought, paused and resumed independently of the others;
+    since the mosaic is live, the output keeps running and a paused
+    tile shows its last frame.
+    """
+
+    def __init__(self, mosaic, index, uri):
+        self.index = index
+        """Index of this tile in :attr:`Mosaic.tiles`."""
+        self._mosaic = mosaic
+        self._pads = []
+        self._video_pad = None
+        self._volume = None
+        self._blocks = []
+        self._offset = 0
+        self._paused_at = None
+        self._pending_seek = None
+
+        self._decoder = Gst.ElementFactory.make('uridecodebin', 'tile%d' % index)
+        self._decoder.set_property('uri', to_uri(uri))
+        self._decoder.set_property('caps', Gst.Caps.from_string('video/x-raw;audio/x-raw'))
+        self._decoder.set_property('expose-all-streams', False)
+        self._decoder.connect('pad-added', self._pad_added)
+        mosaic._pipeline.add(self._decoder)
+
+    def _pad_added(self, decoder, pad):
+        pipeline = self._mosaic._pipeline
+        if pad.query_caps(None).get_structure(0).get_name().startswith('video/'):
+            convert = Gst.ElementFactory.make('videoconvert', None)
+            pipeline.add(convert)
+            self._video_pad = self._mosaic._compositor.get_request_pad('sink_%u')
+            self._mosaic.layout(self)
+            convert.link_pads('src', self._mosaic._compositor, self._video_pad.get_name())
+            elements = [convert]
+            pad.add_probe(Gst.PadProbeType.BUFFER, self._buffer_probe)
+        else:
+            elements = [Gst.ElementFactory.make(name, None) for name in ('audioconvert', 'audioresample', 'volume')]
+            for element in elements:
+                pipeline.add(element)
+            elements[0].link(elements[1])
+            elements[1].link(elements[2])
+            elements[2].link(self._mosaic._audiomixer)
+            self._volume = elements[2]
+        for element in elements:
+            element.sync_state_with_parent()
+        pad.set_offset(self._offset)
+        pad.link(elements[0].get_static_pad('sink'))
+        self._pads.append(pad)
+
+    def _buffer_probe(self, pad, info):
+        ft, self._pending_seek = self._pending_seek, None
+        if ft is not None:
+            self._mosaic._async_loop.call_soon_threadsafe(ft.set_result, None)
+        return Gst.PadProbeReturn.OK
+
+    def _set_offset(self, offset):
+        self._offset = offset
+        for pad in self._pads:
+            pad.set_offset(offset)
+
+    def set_geometry(self, xpos, ypos, width, height):
+        """
+        Moves and resizes this tile, in output pixels.
+        """
+        for name, value in (('xpos', xpos), ('ypos', ypos), ('width', width), ('height', height)):
+            self._video_pad.set_property(name, value)
+
+    def _get_alpha(self):
+        return self._video_pad.get_property('alpha')
+    def _set_alpha(self, value):
+        self._video_pad.set_property('alpha', value)
+    alpha = property(_get_alpha, _set_alpha, doc="""Tile opacity, from 0.0 to 1.0 (read/write).""")
+
+    def _get_volume(self):
+        return 0.0 if self._volume is None else self._volume.get_property('volume')
+    def _set_volume(self, value):
+        if self._volume is not None:
+            self._volume.set_property('volume', value)
+    volume = property(_get_volume, _set_volume, doc="""Sound volume, from 0.0 to 1.0 (read/write).""")
+
+    @property
+    def position(self):
+        """The tile's stream position, in GStreamer units (read only)."""
+        ret, pos = self._decoder.query_position(Gst.Format.TIME)
+        if not ret:
+            raise PlaybinError('Cannot get position')
+        return pos
+
+    async def seek(self, position):
+        """
+        **asynchronous**
+        Seeks this tile to the specified position, in GStreamer
+        units. Returns when the first frame after the seek has been
+        decoded.
+        """
+        ft = self._pending_seek = create_future(self._mosaic._async_loop)
+        if self._paused_at is None:
+            self._set_offset(self._mosaic.running_time())
+        else:
+            self._paused_at = self._offset = self._mosaic.running_time()
+        if not self._decoder.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH|Gst.SeekFlags.KEY_UNIT, position):
+            self._pending_seek = None
+            raise PlaybinError('Seek failed')
+        if self._paused_at is None:
+            await ft
+
+    async def pause(self):
+        """
+        **asynchronous**
+        Pauses this tile.
+        """
+        if self._paused_at is None:
+            self._paused_at = self._mosaic.running_time()
+            self._blocks = [(pad, pad.add_probe(Gst.PadProbeType.BLOCK_DOWNSTREAM, lambda pad, info: Gst.PadProbeReturn.OK)) for pad in self._pads]
+
+    async def play(self):
+        """
+        **asynchronous**
+        Resumes this tile after :func:`pause`.
+        """
+        if self._paused_at is not None:
+            self._set_offset(self._offset + self._mosaic.running_time() - self._paused_at)
+            self._paused_at = None
+            for pad, probe in self._blocks:
+                pad.remove_probe(probe)
+            self._blocks = []
+
+
+class Mosaic(PipelineBase):
+    """
+    Plays several media files as tiles of a single output, through
+    one pipeline based on the compositor and audiomixer elements;
+    this scales much better than one :class:`Playbin` per tile. By
+    default tiles of `tile_width` x `tile_height` pixels are laid out
+    on a grid of `columns` columns. A live background source keeps
+    the output running regardless of individual tiles' state.
+    """
+
+    def __init__(self, uris, columns=None, tile_width=320, tile_height=240, win_id=None, context=None, loop=None):
+        super().__init__(context=context, loop=loop)
+        self._columns = columns or int(math.ceil(math.sqrt(len(uris))))
+        self._tile_width = tile_width
+        self._tile_height = tile_height
+        rows = int(math.ceil(len(uris) / self._columns))
+
+        self._pipeline = Gst.Pipeline.new('mosaic')
+        self._watch_bus(self._pipeline)
+
+        self._compositor = Gst.ElementFactory.make('compositor', 'compositor')
+        self._audiomixer = Gst.ElementFactory.make('audiomixer', 'audiomixer')
+        vsrc = Gst.parse_bin_from_description('videotestsrc is-live=true pattern=black ! video/x-raw,width=%d,height=%d' % (self._columns * tile_width, rows * tile_height), True)
+        asrc = Gst.parse_bin_from_description('audiotestsrc is-live=true wave=silence', True)
+        vsink = self.create_video_sink('videosink') or Gst.ElementFactory.make('autovideosink', 'videosink')
+        asink = self.create_audio_sink('audiosink') or Gst.ElementFactory.make('autoaudiosink', 'audiosink')
+        vconvert = Gst.ElementFactory.make('videoconvert', None)
+        aconvert = Gst.ElementFactory.make('audioconvert', None)
+        for element in (self._compositor, self._audiomixer, vsrc, asrc, vconvert, aconvert, vsink, asink):
+            self._pipeline.add(element)
+        vsrc.link(self._compositor)
+        self._compositor.link(vconvert)
+        vconvert.link(vsink)
+        asrc.link(self._audiomixer)
+        self._audiomixer.link(aconvert)
+        aconvert.link(asink)
+        if win_id is not None:
+            vsink.set_window_handle(win_id)
+
+        self.tiles = [MosaicTile(self, index, uri) for index, uri in enumerate(uris)]
+        """The list of :class:`MosaicTile` objects."""
+
+    def create_video_sink(self, name):
+        """
+        Override this to create a custom video sink.
+        """
+        return None
+
+    def create_audio_sink(self, name):
+        """
+        Override this to create a custom audio sink.
+        """
+        return None
+
+    def layout(self, tile):
+        """
+        Sets the initial geometry of a tile, when its video stream
+        appears. The default lays tiles out on a grid. Warning: this
+        will be called from a streaming thread.
+        """
+        row, column = divmod(tile.index, self._columns)
+        tile.set_geometry(column * self._tile_width, row * self._tile_height, self._tile_width, self._tile_height)
+
+    def running_time(self):
+        """
+        Returns the current running time of the pipeline, in
+        GStreamer units.
+        """
+        clock = self._pipeline.get_clock()
+        if clock is None:
+            return 0
+        return clock.get_time() - self._pipeline.get_base_time()
+
+    @state_change
+    def play(self):
+        """
+        **asynchronous**
+        Starts playing all tiles.
+        """
+        return self._set_state(Gst.State.PLAYING)
+
+    @state_change
+    def stop(self):
+        """
+        **asynchronous**
+        Stops playback.
+        """
+        return self._set_state(Gst.State.NULL)
+
+
+class StreamServer(PipelineBase):
+    """
+    Serves one source to many network clients, reading (and, if
+    needed, decoding) it only once. With `protocol` 'tcp', an MPEG-TS
+    stream is served by a tcpserversink listening on `host` and
+    `port`, and clients connect and disconnect by themselves; with
+    'rtp', MPEG-TS over RTP is sent over UDP to the clients added
+    with :func:`add_client`. If `remux` is True, the source streams
+    are remuxed without re-encoding (they must be formats MPEG-TS can
+    carry, such as H.264 or AAC; other streams are dropped);
+    otherwise they are decoded and encoded with :attr:`VIDEO_ENCODER`
+    and :attr:`AUDIO_ENCODER`. A client lagging more than `max_lag`
+    (in GStreamer units, defaults to 2 seconds) behind the source
+    loses data from its own queue, without slowing the others.
+    """
+
+    VIDEO_ENCODER = 'videoconvert ! x264enc tune=zerolatency speed-preset=ultrafast key-int-max=60 ! h264parse'
+    AUDIO_ENCODER = 'audioconvert ! audioresample ! avenc_aac ! aacparse'
+
+    def __init__(self, uri, protocol='tcp', host='127.0.0.1', port=5000, remux=True, max_lag=None, context=None, loop=None):
+        super().__init__(context=context, loop=loop)
+        if protocol not in ('tcp', 'rtp'):
+            raise PlaybinError('Unsupported protocol %s' % protocol)
+        self._protocol = protocol
+        self._remux = remux
+        self._max_lag = 2 * Gst.SECOND if max_lag is None else max_lag
+        self._clients = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self._pipeline = Gst.Pipeline.new('server')
+        self._watch_bus(self._pipeline)
+
+        self._muxer = Gst.ElementFactory.make('mpegtsmux', 'mux')
+        self._pipeline.add(self._muxer)
+        if protocol == 'tcp':
+            self._sink = Gst.ElementFactory.make('tcpserversink', 'sink')
+            self._sink.set_property('host', host)
+            self._sink.set_property('port', port)
+            # New clients start on a key frame; lagging ones skip ahead
+            # to the latest key frame.
+            self._sink.set_property('sync-method', 2)
+            self._sink.set_property('recover-policy', 3)
+            self._sink.set_property('unit-format', Gst.Format.TIME)
+            self._sink.set_property('units-soft-max', self._max_lag)
+            self._sink.connect('client-added', self._client_added)
+            self._sink.connect('client-socket-removed', self._client_removed)
+            self._pipeline.add(self._sink)
+            self._muxer.link(self._sink)
+        else:
+            # The fakesink branch paces the source, so that the tee
+            # never waits for clients.
+            self._muxer.set_property('alignment', 7)
+            payloader = Gst.parse_bin_from_description('rtpmp2tpay ! tee name=fanout allow-not-linked=true ! queue ! fakesink sync=true', True)
+            self._pipeline.add(payloader)
+            self._muxer.link(payloader)
+            self._tee = payloader.get_by_name('fanout')
+
+        if remux:
+            source = Gst.ElementFactory.make('urisourcebin', 'source')
+            source.set_property('uri', to_uri(uri))
+            parser = Gst.ElementFactory.make('parsebin', 'parser')
+            self._pipeline.add(source)
+            self._pipeline.add(parser)
+            source.connect('pad-added', lambda source, pad: pad.link(parser.get_static_pad('sink')))
+            parser.connect('pad-added', self._pad_added)
+        else:
+            decoder = Gst.ElementFactory.make('uridecodebin', 'source')
+            decoder.set_property('uri', to_uri(uri))
+            decoder.set_property('caps', Gst.Caps.from_string('video/x-raw;audio/x-raw'))
+            self._pipeline.add(decoder)
+            decoder.connect('pad-added', self._pad_added)
+
+    def _pad_added(self, element, pad):
+        elements = [Gst.ElementFactory.make('queue', None)]
+        if not self._remux:
+            video = pad.query_caps(None).get_structure(0).get_name().startswith('video/')
+            elements.insert(0, Gst.parse_bin_from_description(self.VIDEO_ENCODER if video else self.AUDIO_ENCODER, True))
+        for element in elements:
+            self._pipeline.add(element)
+        if len(elements) > 1:
+            elements[0].link(elements[1])
+        if not elements[-1].link(self._muxer):
+            for element in elements:
+                self._pipeline.remove(element)
+            elements = [Gst.ElementFactory.make('fakesink', None)]
+            elements[0].set_property('sync', False)
+            elements[0].set_property('async', False)
+            self._pipeline.add(elements[0])
+        for element in elements:
+            element.sync_state_with_parent()
+        pad.link(elements[0].get_static_pad('sink'))
+
+    def client_joined(self, address):
+        """
+        Override this to be notified when a client joins, as a (host,
+        port) tuple.
+        """
+
+    def client_left(self, address):
+        """
+        Override this to be notified when a client leaves.
+        """
+
+    def _client_added(self, sink, socket):
+        address = socket.get_remote_address()
+        address = (address.get_address().to_string(), address.get_port())
+        with self._lock:
+            self._clients[socket] = address
+        self.call_from_thread(self.client_joined, address)
+
+    def _client_removed(self, sink, socket):
+        with self._lock:
+            address = self._clients.pop(socket, None)
+        if address is not None:
+            self.call_from_thread(self.client_left, address)
+
+    @property
+    def clients(self):
+        """Connected clients, as (host, port) tuples (read only)."""
+        with self._lock:
+            if self._protocol == 'tcp':
+                return list(self._clients.values())
+            return list(self._clients.keys())
+
+    @property
+    def port(self):
+        """Port the TCP server listens on, useful with `port` 0 (read only)."""
+        if self._protocol != 'tcp':
+            raise PlaybinError('Not a TCP server')
+        return self._sink.get_property('current-port')
+
+    def add_client(self, host, port):
+        """
+        Starts sending the stream to `host`:`port` (RTP only).
+        """
+        if self._protocol != 'rtp':
+            raise PlaybinError('TCP clients connect by themselves')
+        with self._lock:
+            if (host, port) in self._clients:
+                return
+            queue = Gst.ElementFactory.make('queue', None)
+            queue.set_property('leaky', 2)
+            queue.set_property('max-size-time', self._max_lag)
+            queue.set_property('max-size-bytes', 0)
+            queue.set_property('max-size-buffers', 0)
+            sink = Gst.ElementFactory.make('udpsink', None)
+            sink.set_property('host', host)
+            sink.set_property('port', port)
+            sink.set_property('sync', False)
+            sink.set_property('async', False)
+            self._pipeline.add(queue)
+            self._pipeline.add(sink)
+            queue.link(sink)
+            sink.sync_state_with_parent()
+            queue.sync_state_with_parent()
+            pad = self._tee.get_request_pad('src_%u')
+            pad.link(queue.get_static_pad('sink'))
+            self._clients[(host, port)] = (pad, queue, sink)
+        self.client_joined((host, port))
+
+    def remove_client(self, host, port):
+        """
+        Stops sending the stream to `host`:`port` (RTP only).
+        """
+        with self._lock:
+            try:
+                pad, queue, sink = self._clients.pop((host, port))
+            except KeyError:
+                raise PlaybinError('Unknown client %s:%d' % (host, port))
+        pad.add_probe(Gst.PadProbeType.IDLE, self._release, queue, sink)
+        self.client_left((host, port))
+
+    def _release(self, pad, info, queue, sink):
+        pad.unlink(queue.get_static_pad('sink'))
+        self._tee.release_request_pad(pad)
+        self.call_from_thread(self._dispose, queue, sink)
+        return Gst.PadProbeReturn.REMOVE
+
+    def _dispose(self, *elements):
+        for element in elements:
+            element.set_state(Gst.State.NULL)
+            self._pipeline.remove(element)
+
+    @state_change
+    def play(self):
+        """
+        **asynchronous**
+        Starts serving.
+        """
+        return self._set_state(Gst.State.PLAYING)
+
+    @state_change
+    def stop(self):
+        """
+        **asynchronous**
+        Stops serving. TCP clients are disconnected; RTP clients
+        are kept.
+        """
+        if self._protocol == 'tcp':
+            with self._lock:
+                self._clients.clear()
+        return self._set_state(Gst.State.NULL)
+
+
+class TranscodeProfile(collections.namedtuple('TranscodeProfile', ['container', 'video', 'audio', 'remux'])):
+    """
+    Target format of a transcode job: container, video and audio
+    caps, as strings (e.g. 'video/quicktime,variant=iso',
+    'video/x-h264', 'audio/mpeg,mpegversion=4'). If `video` or
+    `audio` is None, that stream is dropped. If `remux` is True, the
+    input streams must already be in these formats and are remuxed
+    without decoding.
+    """
+
+    def __new__(cls, container, video=None, audio=None, remux=False):
+        return super().__new__(cls, container, video, audio, remux)
+
+    def __str__(self):
+        return ':'.join(caps for caps in (self.container, self.video, self.audio) if caps is not None)
+
+
+class TranscodeProgress(collections.namedtuple('TranscodeProgress', ['position', 'duration', 'speed', 'attempts', 'error', 'done'])):
+    """
+    Progress of a :class:`TranscodeJob`: position and duration in
+    GStreamer units (None if unknown), speed as a multiple of
+    realtime, number of attempts so far, last error and whether the
+    job succeeded.
+    """
+
+
+class TranscodeJob(PipelineBase):
+    """
+    Transcodes or remuxes `input` (a file name or URI) into the file
+    `output`, according to a :class:`TranscodeProfile`, using the
+    encodebin element.
+    """
+
+    def __init__(self, input, output, profile, context=None, loop=None):
+        super().__init__(context=context, loop=loop)
+        self.input = input
+        self.output = output
+        self.profile = profile
+        self.attempts = 0
+        self.error = None
+        self.done = False
+        self._pipeline = None
+        self._encoder = None
+        self._finished = None
+        self._generation = 0
+        self._started = None
+        self._speed = None
+
+    def _build(self):
+        self._pipeline = Gst.Pipeline.new('transcode')
+        decoder = Gst.ElementFactory.make('uridecodebin', 'decoder')
+        decoder.set_property('uri', to_uri(self.input))
+        if self.profile.remux:
+            decoder.set_property('caps', Gst.Caps.from_string(';'.join(caps for caps in (self.profile.video, self.profile.audio) if caps is not None)))
+        decoder.connect('pad-added', self._pad_added)
+        self._encoder = Gst.ElementFactory.make('encodebin', 'encoder')
+        Gst.util_set_object_arg(self._encoder, 'profile', str(self.profile))
+        sink = Gst.ElementFactory.make('filesink', 'sink')
+        sink.set_property('location', self.output)
+        for element in (decoder, self._encoder, sink):
+            self._pipeline.add(element)
+        self._encoder.link(sink)
+        self._watch_bus(self._pipeline)
+
+    def _pad_added(self, decoder, pad):
+        sinkpad = self._encoder.emit('request-pad', pad.query_caps(None))
+        if sinkpad is not None:
+            pad.link(sinkpad)
+
+    # Bus callbacks are queued to the asyncio loop, where they may run
+    # after a retry started: each attempt has its own generation, and
+    # callbacks from an older one are ignored.
+
+    def _error(self, bus, msg):
+        err, dbg = msg.parse_error()
+        if not self._operations.fail(PlaybinError('%s: %s' % (err, dbg))):
+            self.call_from_thread(self._finish, self._generation, PlaybinError('Unexpected async error (%s[%s])' % (err, dbg)))
 
     def _EOS(self, bus, msg):
-        self.call_from_thread(self.end_of_stream)
+        self.call_from_thread(self._finish, self._generation, None)
+
+    def _finish(self, generation, exc):
+        if generation != self._generation or self._finished.done():
+            return
+        if exc is None:
+            self._finished.set_result(None)
+            self.end_of_stream()
+        else:
+            self._finished.set_exception(exc)
+            self.async_error(exc)
 
-    def _async_done(self, bus, msg):
+    @state_change
+    def _start(self):
+        return self._set_state(Gst.State.PLAYING)
+
+    async def run(self):
+        """
+        **asynchronous**
+        Runs the job once; raises :class:`PlaybinError` on failure.
+        """
+        self.attempts += 1
+        self._generation += 1
+        self._finished = create_future(self._async_loop)
+        self._started = time.monotonic()
+        self._speed = None
+        self._build()
         try:
-            ft = self._async_response.pop(0)
-        except IndexError:
-            self.call_from_thread(self.async_error, PlaybinError('Unexpected ASYNC_DONE response'))
+            await self._start()
+            await self._finished
+        except PlaybinError as exc:
+            self.error = exc
+            raise
         else:
-            self._async_loop.call_soon_threadsafe(ft.set_result, None)
+            self.done = True
+            self.error = None
+        finally:
+            self._speed = self.progress().speed
+            self._pipeline.set_state(Gst.State.NULL)
+            self._pipeline.get_bus().remove_signal_watch()
+            self._pipeline = self._encoder = None
+            self._operations.fail(PlaybinError('Pipeline stopped'))
+
+    def progress(self):
+        """
+        Returns the job's :class:`TranscodeProgress`.
+        """
+        position = duration = None
+        speed = self._speed
+        if self._pipeline is not None:
+            ret, pos = self._pipeline.query_position(Gst.Format.TIME)
+            position = pos if ret else None
+            ret, dur = self._pipeline.query_duration(Gst.Format.TIME)
+            duration = dur if ret else None
+            elapsed = time.monotonic() - self._started
+            if position is not None and elapsed > 0:
+                speed = position / Gst.SECOND / elapsed
+        return TranscodeProgress(position, duration, speed, self.attempts, self.error, self.done)
+
+
+class TranscodeRunner(object):
+    """
+    Runs a batch of transcode jobs, given as (input, output, profile)
+    tuples, with at most `concurrency` jobs at a time (defaults to
+    the number of CPUs). Failed jobs are retried up to `retries`
+    times without affecting the others.
+    """
+
+    def __init__(self, jobs, concurrency=None, retries=1, context=None, loop=None):
+        self.jobs = [TranscodeJob(input, output, profile, context=context, loop=loop) for input, output, profile in jobs]
+        """The list of :class:`TranscodeJob` objects."""
+        self._concurrency = concurrency or os.cpu_count() or 1
+        self._retries = retries
+
+    async def _run_job(self, semaphore, job):
+        async with semaphore:
+            while True:
+                try:
+                    await job.run()
+                except PlaybinError:
+                    if job.attempts > self._retries:
+                        return
+                else:
+                    return
+
+    async def run(self):
+        """
+        **asynchronous**
+        Runs all jobs. Returns the list of jobs that failed.
+        """
+        semaphore = asyncio.Semaphore(self._concurrency)
+        await asyncio.gather(*[self._run_job(semaphore, job) for job in self.jobs])
+        return [job for job in self.jobs if not job.done]
+
+    def progress(self):
+        """
+        Returns a list of :class:`TranscodeProgress`, one per job.
+        """
+        return [job.progress() for job in self.jobs]
+
+
+class DecodeRun(object):
+    """
+    Base class for analysis runs. Samples go through the `branch`
+    pipeline description into an appsink, and each one is handed to
+    :func:`process` from the streaming thread.
+
+    A run either attaches to a :class:`Playbin` (see its `analyzers`
+    argument) and analyzes the frames decoded for playback, without
+    decoding the file a second time (see :func:`wait`); or decodes
+    `filename` on its own, as fast as possible (see :func:`run`).
+    An attached run sees the stream as played, seeks included, and
+    skips samples rather than stall playback when it falls behind.
+    For standalone runs, only the streams matching `decode_caps` are
+    decoded; if several match, `stream` selects one, either by its
+    stream-id or by its index among matching streams. The run fails
+    if there is no such stream. If `cache_dir` is specified, results
+    are cached there per file (`filename` may be None for attached
+    runs, disabling the cache).
+    """
+
+    QUEUE = 32
+
+    def __init__(self, filename, decode_caps, branch, cache_dir=None, stream=0):
+        self._async_loop = current_loop()
+        self._filename = filename
+        self._decode_caps = decode_caps
+        self._branch = branch
+        self._cache_dir = cache_dir
+        self._stream = stream
+        self._streams = 0
+        self._linked = False
+        self._future = None
+
+    def process(self, sample):
+        """
+        Override this to handle a decoded sample. Warning: this will
+        be called from a streaming thread.
+        """
+
+    def result(self):
+        """
+        Override this to return the result of the run. It must be
+        JSON-serializable if caching is used.
+        """
+
+    def parameters(self):
+        """
+        Override this to return the parameters that affect the
+        result, as a JSON-serializable object; used in the cache key.
+        """
+        return None
+
+    def _cache_path(self):
+        if self._cache_dir is None or self._filename is None:
+            return None
+        uri = to_uri(self._filename)
+        if uri.startswith('file://'):
+            st = os.stat(Gst.filename_from_uri(uri)[0])
+            key = json.dumps([type(self).__name__, uri, st.st_size, st.st_mtime, self._stream, self.parameters()])
+        else:
+            key = json.dumps([type(self).__name__, uri, self._stream, self.parameters()])
+        return os.path.join(self._cache_dir, '%s.json' % hashlib.sha1(key.encode('UTF-8')).hexdigest())
+
+    async def run(self):
+        """
+        **asynchronous**
+        Decodes the whole file (or loads the cached result) and
+        returns :func:`result`.
+        """
+        path = self._cache_path()
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as fileobj:
+                return json.load(fileobj)
+
+        # The run may be created outside of the loop it runs on.
+        self._async_loop = asyncio.get_running_loop()
+        pipeline = Gst.Pipeline.new(None)
+        decoder = Gst.ElementFactory.make('uridecodebin', 'decoder')
+        decoder.set_property('expose-all-streams', False)
+        decoder.set_property('caps', Gst.Caps.from_string(self._decode_caps))
+        decoder.set_property('uri', to_uri(self._filename))
+        branch = self._sink_bin(self._branch)
+        pipeline.add(decoder)
+        pipeline.add(branch)
+        self._streams = 0
+        self._linked = False
+        decoder.connect('pad-added', self._pad_added, pipeline, branch)
+        decoder.connect('no-more-pads', self._no_more_pads)
+
+        bus = pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::error', self._error)
+        bus.connect('message::eos', self._EOS)
+
+        self._future = create_future(self._async_loop)
+        try:
+            ret = pipeline.set_state(Gst.State.PLAYING)
+            if ret == Gst.StateChangeReturn.FAILURE:
+                raise PlaybinGstError(ret)
+            await self._future
+        finally:
+            pipeline.set_state(Gst.State.NULL)
+            bus.remove_signal_watch()
+        return self._store(path)
+
+    async def wait(self):
+        """
+        **asynchronous**
+        For a run attached to a :class:`Playbin`, waits for the end
+        of the stream and returns :func:`result` (which may also be
+        called before, for partial results).
+        """
+        if self._future is None:
+            raise PlaybinError('Not attached to a player')
+        await self._future
+        return self._store(self._cache_path())
+
+    def _store(self, path):
+        result = self.result()
+        if path is not None:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with open(path, 'w') as fileobj:
+                json.dump(result, fileobj)
+        return result
+
+    def _sink_bin(self, description):
+        branch = Gst.parse_bin_from_description('%s ! appsink name=sink sync=false emit-signals=true max-buffers=16' % description, True)
+        sink = branch.get_by_name('sink')
+        sink.connect('new-sample', self._new_sample)
+        return branch
+
+    def _attach(self, loop):
+        # Called by Playbin while building its pipeline. The leaky
+        # queue and the asynchronous appsink keep the analysis from
+        # holding playback or prerolling back.
+        self._async_loop = loop
+        self._future = create_future(loop)
+        branch = self._sink_bin('queue leaky=downstream max-size-buffers=%d max-size-bytes=0 max-size-time=0 ! %s' % (self.QUEUE, self._branch))
+        sink = branch.get_by_name('sink')
+        sink.set_property('async', False)
+        sink.connect('eos', lambda sink: self._async_loop.call_soon_threadsafe(self._resolve, None))
+        return branch
+
+    def stop(self):
+        """
+        Ends the run early, as if the end of the stream was reached;
+        may be called from :func:`process`.
+        """
+        self._async_loop.call_soon_threadsafe(self._resolve, None)
+
+    def _pad_added(self, decoder, pad, pipeline, branch):
+        # Streams other than the selected one are discarded.
+        index, self._streams = self._streams, self._streams + 1
+        if isinstance(self._stream, str):
+            selected = pad.get_stream_id() == self._stream
+        else:
+            selected = index == self._stream
+        if selected and not self._linked:
+            self._linked = True
+            pad.link(branch.get_static_pad('sink'))
+            return
+        discard = Gst.ElementFactory.make('fakesink', None)
+        discard.set_property('sync', False)
+        discard.set_property('async', False)
+        pipeline.add(discard)
+        discard.sync_state_with_parent()
+        pad.link(discard.get_static_pad('sink'))
+
+    def _no_more_pads(self, decoder):
+        if not self._linked:
+            self._async_loop.call_soon_threadsafe(self._resolve, PlaybinError('No stream %s in %s' % (self._stream, self._filename)))
+
+    def _new_sample(self, sink):
+        self.process(sink.emit('pull-sample'))
+        return Gst.FlowReturn.OK
+
+    def _resolve(self, exc):
+        if not self._future.done():
+            if exc is None:
+                self._future.set_result(None)
+            else:
+                self._future.set_exception(exc)
+
+    def _error(self, bus, msg):
+        err, dbg = msg.parse_error()
+        self._async_loop.call_soon_threadsafe(self._resolve, PlaybinError('%s: %s' % (err, dbg)))
+
+    def _EOS(self, bus, msg):
+        self._async_loop.call_soon_threadsafe(self._resolve, None)
+
+
+class Cue(collections.namedtuple('Cue', ['start', 'end', 'text'])):
+    """
+    A subtitle cue: start and end time in GStreamer units, and plain
+    text (markup removed).
+    """
+
+
+class SubtitleExtractor(DecodeRun):
+    """
+    Decodes a subtitle stream (embedded, or a standalone subtitle
+    file) as fast as possible. The result is a list of [start, end,
+    text] lists, sorted by start time.
+    """
+
+    MARKUP = re.compile(r'<[^>]*>')
+
+    def __init__(self, filename, cache_dir=None, stream=0):
+        super().__init__(filename, 'text/x-raw', 'identity', cache_dir=cache_dir, stream=stream)
+        self._cues = []
+
+    def process(self, sample):
+        buf = sample.get_buffer()
+        if buf.pts == Gst.CLOCK_TIME_NONE:
+            return
+        text = buf.extract_dup(0, buf.get_size()).decode('UTF-8', 'replace').rstrip('\0')
+        text = html.unescape(self.MARKUP.sub('', text)).strip()
+        if not text:
+            return
+        end = buf.pts + buf.duration if buf.duration != Gst.CLOCK_TIME_NONE else buf.pts
+        self._cues.append([buf.pts, end, text])
+
+    def result(self):
+        return sorted(self._cues)
+
+
+class CueIndex(object):
+    """
+    Time and full-text index over a list of :class:`Cue`. Time
+    lookups are binary searches; text search goes through an
+    inverted word index.
+    """
+
+    WORD = re.compile(r'\w+')
+
+    def __init__(self, cues):
+        self._cues = sorted(cues)
+        self._starts = [cue.start for cue in self._cues]
+        # Largest end time among the cues up to each position, so that
+        # overlapping lookups can stop scanning early.
+        self._reach = []
+        reach = 0
+        for cue in self._cues:
+            reach = max(reach, cue.end)
+            self._reach.append(reach)
+        self._words = collections.defaultdict(list)
+        for position, cue in enumerate(self._cues):
+            for word in set(self.WORD.findall(cue.text.lower())):
+                self._words[word].append(position)
+
+    def __len__(self):
+        return len(self._cues)
+
+    def __iter__(self):
+        return iter(self._cues)
+
+    def __getitem__(self, index):
+        return self._cues[index]
+
+    def at(self, position):
+        """
+        Returns the cues displayed at `position` (in GStreamer
+        units), by start time.
+        """
+        return self.between(position, position + 1)
+
+    def between(self, start, end):
+        """
+        Returns the cues overlapping the [`start`, `end`) interval, by
+        start time.
+        """
+        result = []
+        index = bisect.bisect_left(self._starts, end) - 1
+        while index >= 0 and self._reach[index] > start:
+            cue = self._cues[index]
+            if cue.end > start:
+                result.append(cue)
+            index -= 1
+        result.reverse()
+        return result
+
+    def search(self, text):
+        """
+        Returns the cues containing the words of `text`, in that
+        order (case and punctuation insensitive), by start time.
+        """
+        words = self.WORD.findall(text.lower())
+        if not words:
+            return []
+        positions = set(self._words.get(words[0], ()))
+        for word in words[1:]:
+            positions.intersection_update(self._words.get(word, ()))
+        phrase = ' %s ' % ' '.join(words)
+        return [self._cues[position] for position in sorted(positions)
+                if len(words) == 1 or phrase in ' %s ' % ' '.join(self.WORD.findall(self._cues[position].text.lower()))]
+
+
+class ShotDetector(DecodeRun):
+    """
+    Shot boundary detection. Frames are downscaled to a thumbnail,
+    and consecutive frames are compared through their RGB
+    histograms. The histogram distance (between 0 and 1) is stored
+    in :attr:`scores`; boundaries are frames whose distance to the
+    previous one exceeds `threshold`. Requires NumPy.
+    """
+
+    SIZE = 64
+    BITS = 3
+    BATCH = 64
+
+    def __init__(self, filename, threshold=0.4, cache_dir=None):
+        require_numpy('shot detection')
+        super().__init__(filename, 'video/x-raw', 'videoconvert ! videoscale ! video/x-raw,format=RGB,width=%d,height=%d' % (self.SIZE, self.SIZE), cache_dir=cache_dir)
+        self._threshold = threshold
+        self._frames = []
+        self._timestamps = []
+        self._previous = None
+        self.scores = []
+        """List of (timestamp, score) tuples, one per frame but the first."""
+
+    def parameters(self):
+        return self._threshold
+
+    def shot_boundary(self, timestamp):
+        """
+        Override this to be notified of boundaries as they are
+        detected (not called when the result comes from the
+        cache). Called from the asyncio loop.
+        """
+
+    def process(self, sample):
+        buf = sample.get_buffer()
+        self._frames.append(numpy.frombuffer(buf.extract_dup(0, buf.get_size()), dtype=numpy.uint8))
+        self._timestamps.append(buf.pts)
+        if len(self._frames) == self.BATCH:
+            self._flush()
+
+    def _flush(self):
+        if not self._frames:
+            return
+        count, bins = len(self._frames), 1 << (3 * self.BITS)
+        frames = numpy.stack(self._frames).reshape(count, -1, 3) >> (8 - self.BITS)
+        indexes = (frames[..., 0].astype(numpy.intp) << (2 * self.BITS)) | (frames[..., 1] << self.BITS) | frames[..., 2]
+        indexes += numpy.arange(count, dtype=numpy.intp)[:, None] * bins
+        hists = numpy.bincount(indexes.ravel(), minlength=count * bins).reshape(count, bins)
+
+        timestamps = self._timestamps
+        if self._previous is not None:
+            hists = numpy.vstack([self._previous[None], hists])
+        else:
+            timestamps = timestamps[1:]
+        diffs = numpy.abs(numpy.diff(hists, axis=0)).sum(axis=1) / (2.0 * self.SIZE * self.SIZE)
+        for timestamp, score in zip(timestamps, diffs.tolist()):
+            self.scores.append((timestamp, score))
+            if score > self._threshold:
+                self._async_loop.call_soon_threadsafe(self.shot_boundary, timestamp)
+
+        self._previous = hists[-1]
+        self._frames = []
+        self._timestamps = []
+
+    def result(self):
+        self._flush()
+        return [timestamp for timestamp, score in self.scores if score > self._threshold]
+
+
+class AudioFingerprinter(DecodeRun):
+    """
+    Spectral audio fingerprint of the first `duration` seconds of a
+    file (None for the whole file). Audio is downmixed and resampled,
+    and each frame yields a 32-bit sub-fingerprint: the signs of the
+    energy differences between adjacent bands and consecutive
+    frames. The result is the list of sub-fingerprints, one every
+    :attr:`HOP` samples at :attr:`RATE`. Requires NumPy.
+    """
+
+    RATE = 5512
+    FRAME = 2048
+    HOP = 64
+    BANDS = 33
+    LOW = 300
+    HIGH = 2000
+    BATCH = 1024
+
+    def __init__(self, filename, duration=120, cache_dir=None, stream=0):
+        require_numpy('audio fingerprinting')
+        super().__init__(filename, 'audio/x-raw', 'audioconvert ! audioresample ! audio/x-raw,format=F32LE,channels=1,rate=%d' % self.RATE, cache_dir=cache_dir, stream=stream)
+        self._duration = duration
+        self._limit = None if duration is None else int(duration * self.RATE)
+        self._received = 0
+        self._samples = []
+        self._pending = 0
+        self._previous = None
+        self._codes = []
+        self._window = numpy.hanning(self.FRAME).astype(numpy.float32)
+        edges = numpy.geomspace(self.LOW, self.HIGH, self.BANDS + 1)
+        self._edges = numpy.round(edges * self.FRAME / self.RATE).astype(numpy.intp)
+
+    def parameters(self):
+        return self._duration
+
+    def process(self, sample):
+        if self._limit is not None and self._received >= self._limit:
+            return
+        buf = sample.get_buffer()
+        data = numpy.frombuffer(buf.extract_dup(0, buf.get_size()), dtype=numpy.float32)
+        if self._limit is not None:
+            data = data[:self._limit - self._received]
+        self._received += len(data)
+        self._samples.append(data)
+        self._pending += len(data)
+        if self._pending >= self.FRAME + self.HOP * self.BATCH:
+            self._flush()
+        if self._limit is not None and self._received >= self._limit:
+            self.stop()
+
+    def _flush(self):
+        if not self._samples:
+            return
+        samples = numpy.concatenate(self._samples)
+        count = (len(samples) - self.FRAME) // self.HOP + 1
+        if count <= 0:
+            return
+        frames = numpy.lib.stride_tricks.as_strided(samples, shape=(count, self.FRAME), strides=(samples.strides[0] * self.HOP, samples.strides[0]))
+        spectrum = numpy.abs(numpy.fft.rfft(frames * self._window, axis=1)) ** 2
+        first = self._edges[0]
+        energies = numpy.add.reduceat(spectrum[:, first:self._edges[-1]], self._edges[:-1] - first, axis=1)
+        diffs = energies[:, :-1] - energies[:, 1:]
+        if self._previous is not None:
+            diffs = numpy.vstack([self._previous[None], diffs])
+        bits = (diffs[1:] - diffs[:-1]) > 0
+        self._codes.append((bits.astype(numpy.uint32) << numpy.arange(self.BANDS - 1, dtype=numpy.uint32)).sum(axis=1, dtype=numpy.uint32))
+        self._previous = diffs[-1]
+        tail = samples[count * self.HOP:]
+        self._samples = [tail]
+        self._pending = len(tail)
+
+    def result(self):
+        self._flush()
+        if not self._codes:
+            return []
+        return numpy.concatenate(self._codes).tolist()
+
+
+class FingerprintMatch(collections.namedtuple('FingerprintMatch', ['key', 'offset', 'ber'])):
+    """
+    A :func:`FingerprintIndex.query` result: the key of the matching
+    file, the offset of the query within it (in GStreamer units, may
+    be negative), and the bit error rate over the overlap (0 for
+    identical audio, around 0.5 for unrelated audio).
+    """
+
+
+class FingerprintIndex(object):
+    """
+    Near-duplicate index over :class:`AudioFingerprinter` results.
+    Every `stride`-th sub-fingerprint of each file is kept in a
+    sorted lookup table; a query looks up all its sub-fingerprints,
+    votes for (file, offset) alignments, and verifies by bit error
+    rate the best-voted alignment of each of the `candidates` files
+    with the most votes. Requires NumPy.
+    """
+
+    CANDIDATES = 8
+    MIN_OVERLAP = 64
+
+    def __init__(self, stride=4):
+        require_numpy('audio fingerprinting')
+        self._stride = stride
+        self.keys = []
+        """Keys of the indexed files, in insertion order."""
+        self._fingerprints = []
+        self._table = None
+        self._pending = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, fingerprint):
+        """
+        Indexes `fingerprint` (a list of sub-fingerprints) under
+        `key`, typically the file name.
+        """
+        fingerprint = numpy.asarray(fingerprint, dtype=numpy.uint32)
+        track = len(self.keys)
+        self.keys.append(key)
+        self._fingerprints.append(fingerprint)
+        offsets = numpy.arange(0, len(fingerprint), self._stride, dtype=numpy.uint32)
+        hashes = fingerprint[offsets]
+        # Silence gives all-zero (or all-one) sub-fingerprints, which
+        # match everything.
+        keep = (hashes != 0) & (hashes != 0xffffffff)
+        self._pending.append((hashes[keep], numpy.full(int(keep.sum()), track, dtype=numpy.uint32), offsets[keep]))
+
+    def _lookup_table(self):
+        if self._pending:
+            parts = self._pending if self._table is None else [self._table] + self._pending
+            hashes, tracks, offsets = [numpy.concatenate(column) for column in zip(*parts)]
+            order = numpy.argsort(hashes, kind='stable')
+            self._table = (hashes[order], tracks[order], offsets[order])
+            self._pending = []
+        return self._table
+
+    def _ber(self, query, reference, shift):
+        start = max(0, -shift)
+        end = min(len(query), len(reference) - shift)
+        if end - start < self.MIN_OVERLAP:
+            return 1.0
+        errors = numpy.unpackbits((query[start:end] ^ reference[start + shift:end + shift]).view(numpy.uint8)).sum()
+        return float(errors) / (32 * (end - start))
+
+    def _query(self, query, max_ber, candidates, exclude=None):
+        table = self._lookup_table()
+        if table is None or not len(query):
+            return []
+        hashes, tracks, offsets = table
+        left = numpy.searchsorted(hashes, query, 'left')
+        counts = numpy.searchsorted(hashes, query, 'right') - left
+        total = int(counts.sum())
+        if not total:
+            return []
+        ends = numpy.cumsum(counts)
+        entries = numpy.repeat(left - (ends - counts), counts) + numpy.arange(total)
+        positions = numpy.repeat(numpy.arange(len(query), dtype=numpy.int64), counts)
+        shifts = offsets[entries].astype(numpy.int64) - positions
+        votes = (tracks[entries].astype(numpy.int64) << 32) + (shifts + (1 << 31))
+        votes, counts = numpy.unique(votes, return_counts=True)
+        voted = votes >> 32
+        if exclude is not None:
+            keep = voted != exclude
+            votes, counts, voted = votes[keep], counts[keep], voted[keep]
+        if not len(votes):
+            return []
+
+        # One file gets votes at several neighbouring shifts: keep its
+        # best-voted one, so that it takes a single candidate slot.
+        order = numpy.lexsort((-counts, voted))
+        first = order[numpy.concatenate(([True], voted[order][1:] != voted[order][:-1]))]
+        matches = []
+        for vote in votes[first[numpy.argsort(-counts[first], kind='stable')[:candidates]]].tolist():
+            track, shift = vote >> 32, (vote & 0xffffffff) - (1 << 31)
+            ber = self._ber(query, self._fingerprints[track], shift)
+            if ber <= max_ber:
+                matches.append((track, shift, ber))
+        return sorted(matches, key=lambda match: match[2])
+
+    def _match(self, track, shift, ber):
+        hop = Gst.SECOND * AudioFingerprinter.HOP // AudioFingerprinter.RATE
+        return FingerprintMatch(self.keys[track], shift * hop, ber)
+
+    def query(self, fingerprint, max_ber=0.35, candidates=CANDIDATES):
+        """
+        Returns the indexed files matching `fingerprint` with a bit
+        error rate of at most `max_ber`, as a list of
+        :class:`FingerprintMatch`, best first. At most `candidates`
+        files are verified, so at most that many are returned.
+        """
+        query = numpy.asarray(fingerprint, dtype=numpy.uint32)
+        return [self._match(*match) for match in self._query(query, max_ber, candidates)]
+
+    def duplicates(self, max_ber=0.35, candidates=CANDIDATES):
+        """
+        Returns all pairs of indexed files matching each other, as
+        (key, :class:`FingerprintMatch`) tuples. `candidates` is the
+        number of files verified per file, see :func:`query`.
+        """
+        pairs = []
+        seen = set()
+        for track, fingerprint in enumerate(self._fingerprints):
+            for match in self._query(fingerprint, max_ber, candidates, exclude=track):
+                pair = (min(track, match[0]), max(track, match[0]))
+                if pair not in seen:
+                    seen.add(pair)
+                    pairs.append((self.keys[track], self._match(*match)))
+        return pairs
+
+    def save(self, path):
+        """
+        Saves the index to `path`, in NumPy's .npz format.
+        """
+        lengths = numpy.array([len(fingerprint) for fingerprint in self._fingerprints], dtype=numpy.int64)
+        fingerprints = numpy.concatenate(self._fingerprints) if self._fingerprints else numpy.zeros(0, dtype=numpy.uint32)
+        with open(path, 'wb') as fileobj:
+            numpy.savez(fileobj, keys=numpy.array(json.dumps(self.keys)), lengths=lengths, fingerprints=fingerprints, stride=self._stride)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved with :func:`save`.
+        """
+        require_numpy('audio fingerprinting')
+        with numpy.load(path) as data:
+            index = cls(stride=int(data['stride']))
+            fingerprints = data['fingerprints']
+            start = 0
+            for key, length in zip(json.loads(str(data['keys'])), data['lengths'].tolist()):
+                index.add(key, fingerprints[start:start + length])
+                start += length
+        return index
+
+
+class FingerprintRunner(object):
+    """
+    Fingerprints a batch of files into a :class:`FingerprintIndex`
+    (a new one unless `index` is given), with at most `concurrency`
+    files decoded at a time (defaults to the number of CPUs).
+    Decoding and the NumPy transforms run outside the interpreter
+    lock, so files are processed in parallel.
+    """
+
+    def __init__(self, filenames, duration=120, concurrency=None, cache_dir=None, index=None):
+        self._filenames = list(filenames)
+        self._duration = duration
+        self._concurrency = concurrency or os.cpu_count() or 1
+        self._cache_dir = cache_dir
+        self.index = FingerprintIndex() if index is None else index
+        """The :class:`FingerprintIndex` being filled."""
+        self.errors = dict()
+        """Files that could not be fingerprinted, mapped to the error."""
+
+    async def _fingerprint(self, semaphore, filename):
+        async with semaphore:
+            try:
+                fingerprint = await AudioFingerprinter(filename, duration=self._duration, cache_dir=self._cache_dir).run()
+            except PlaybinError as exc:
+                self.errors[filename] = exc
+            else:
+                self.index.add(filename, fingerprint)
+
+    async def run(self):
+        """
+        **asynchronous**
+        Fingerprints all files and returns the index.
+        """
+        semaphore = asyncio.Semaphore(self._concurrency)
+        await asyncio.gather(*[self._fingerprint(semaphore, filename) for filename in self._filenames])
+        return self.index
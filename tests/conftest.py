@@ -0,0 +1,63 @@
+# This software is released under the terms of the MIT license. See the LICENSE file for details.
+
+"""
+Shared fixtures. Test modules skip themselves when PyGObject is
+missing; media is synthesized with videotestsrc/audiotestsrc and
+all sinks are fake, so the suite runs without a display or sound
+card.
+"""
+
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def fake_playbin_class():
+    from gi.repository import Gst
+    from pyplaybin import Playbin
+
+    class FakePlaybin(Playbin):
+        def create_video_sink(self, name):
+            sink = Gst.ElementFactory.make('fakesink', name)
+            sink.set_property('sync', True)
+            return sink
+
+        def create_audio_sink(self, name):
+            sink = Gst.ElementFactory.make('fakesink', name)
+            sink.set_property('sync', True)
+            return sink
+
+    return FakePlaybin
+
+
+@pytest.fixture(scope='session')
+def glib_loop():
+    from pyplaybin import Playbin
+    Playbin.start_glib_loop()
+    yield
+    Playbin.stop_glib_loop()
+
+
+@pytest.fixture(scope='session')
+def FakePlaybin(glib_loop):
+    return fake_playbin_class()
+
+
+@pytest.fixture(scope='session')
+def media(glib_loop, tmp_path_factory):
+    """A two-second AVI file with raw video and audio."""
+    from gi.repository import Gst
+    filename = str(tmp_path_factory.mktemp('media') / 'test.avi')
+    pipeline = Gst.parse_launch(
+        'avimux name=mux ! filesink location="%s" '
+        'videotestsrc num-buffers=30 pattern=ball ! video/x-raw,format=I420,width=160,height=120,framerate=15/1 ! queue ! mux. '
+        'audiotestsrc num-buffers=40 samplesperbuffer=2205 ! audio/x-raw,format=S16LE,rate=44100,channels=1 ! queue ! mux. '
+        % filename)
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS|Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        pytest.skip('Cannot create test media: %s' % msg.parse_error()[0])
+    return filename
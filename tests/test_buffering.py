@@ -0,0 +1,57 @@
+# This software is released under the terms of the MIT license. See the LICENSE file for details.
+
+import asyncio, functools, os, threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+pytest.importorskip('gi')
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_url(media):
+    from gi.repository import Gst
+    if Gst.ElementFactory.find('souphttpsrc') is None:
+        pytest.skip('souphttpsrc is not available')
+    handler = functools.partial(QuietHandler, directory=os.path.dirname(media))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield 'http://127.0.0.1:%d/%s' % (server.server_address[1], os.path.basename(media))
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.mark.parametrize('options', [{}, {'download': 'disk'}, {'download': 'ring', 'ring_buffer_size': 1 << 20}])
+def test_play_over_http(FakePlaybin, http_url, options):
+    async def scenario():
+        player = FakePlaybin()
+        player.set_buffering(low_watermark=0.1, high_watermark=0.5, **options)
+        progress = []
+        player.buffering_progress = progress.append
+        done = asyncio.get_running_loop().create_future()
+        player.end_of_stream = lambda: done.done() or done.set_result(None)
+        await player.play(http_url, timeout=10)
+        await player.pause(timeout=10)
+        await player.play(timeout=10)
+        await asyncio.wait_for(done, 10)
+        await player.stop()
+        return progress
+
+    progress = asyncio.run(scenario())
+    assert progress and progress[-1] == 100
+
+
+def test_ring_download_requires_size(FakePlaybin):
+    async def scenario():
+        player = FakePlaybin()
+        with pytest.raises(ValueError):
+            player.set_buffering(download='ring')
+
+    asyncio.run(scenario())
@@ -0,0 +1,39 @@
+# This software is released under the terms of the MIT license. See the LICENSE file for details.
+
+import asyncio
+
+import pytest
+
+pytest.importorskip('gi')
+
+
+def test_group_load_play_seek(FakePlaybin, media):
+    from gi.repository import Gst
+    from pyplaybin import PlaybinGroup
+
+    async def scenario():
+        players = [FakePlaybin(), FakePlaybin()]
+        for player in players:
+            player.timeout = 10
+        group = PlaybinGroup(players)
+        await group.load([media, media])
+
+        base_time = await group.play()
+        assert group.base_time == base_time
+        for player in players:
+            element = player._playbin._element
+            assert element.get_clock() == group.clock
+            assert element.get_base_time() == base_time
+        await asyncio.sleep(0.3)
+        positions = [player.position for player in players]
+        assert abs(positions[0] - positions[1]) < Gst.SECOND // 10
+
+        await group.seek(Gst.SECOND, accurate=True)
+        assert group.base_time is not None
+        assert all(player.position >= Gst.SECOND for player in players)
+
+        await group.pause()
+        assert group.base_time is None
+        await group.stop()
+
+    asyncio.run(scenario())
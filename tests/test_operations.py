@@ -0,0 +1,201 @@
+# This software is released under the terms of the MIT license. See the LICENSE file for details.
+
+"""
+Tests of the registry of pending asynchronous operations. It is pure
+logic, so GStreamer is replaced by a stub pipeline and state enum.
+"""
+
+import asyncio, enum
+
+import pytest
+
+import pyplaybin
+from pyplaybin import PlaybinError, PlaybinTimeout, PipelineBase, _Operations
+
+
+class State(enum.IntEnum):
+    VOID_PENDING = 0
+    NULL = 1
+    READY = 2
+    PAUSED = 3
+    PLAYING = 4
+
+
+class StubGst(object):
+    State = State
+
+
+class StubPipeline(object):
+    def __init__(self, current=State.NULL, pending=State.VOID_PENDING):
+        self.current = current
+        self.pending = pending
+
+    def get_state(self, timeout):
+        assert timeout == 0
+        return None, self.current, self.pending
+
+
+@pytest.fixture(autouse=True)
+def stub_gst(monkeypatch):
+    monkeypatch.setattr(pyplaybin, 'Gst', StubGst)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def operations(loop):
+    operations = _Operations(loop)
+    operations.pipeline = StubPipeline(State.READY, State.PAUSED)
+    return operations
+
+
+def flush(loop):
+    # Futures are resolved through call_soon_threadsafe().
+    loop.run_until_complete(asyncio.sleep(0))
+
+
+def test_state_change_already_complete(loop, operations):
+    operations.pipeline.current, operations.pipeline.pending = State.PLAYING, State.VOID_PENDING
+    ft = operations.expect_state(State.PLAYING)
+    flush(loop)
+    assert ft.done() and ft.result() is None
+
+
+def test_state_change_completes_on_target(loop, operations):
+    ft = operations.expect_state(State.PLAYING)
+    operations.state_changed(State.PAUSED, State.PLAYING)
+    flush(loop)
+    assert not ft.done()
+    operations.state_changed(State.PLAYING, State.VOID_PENDING)
+    flush(loop)
+    assert ft.done()
+
+
+def test_out_of_order_state_changed(loop, operations):
+    ft = operations.expect_state(State.PLAYING)
+    operations.state_changed(State.PLAYING, State.VOID_PENDING)
+    operations.state_changed(State.PAUSED, State.PLAYING)
+    flush(loop)
+    assert ft.done() and ft.exception() is None
+    assert not operations.fail(PlaybinError('Nothing pending'))
+
+
+def test_intermediate_target_completes_first(loop, operations):
+    paused = operations.expect_state(State.PAUSED)
+    playing = operations.expect_state(State.PLAYING)
+    operations.state_changed(State.PAUSED, State.PLAYING)
+    flush(loop)
+    assert paused.done() and not playing.done()
+    operations.state_changed(State.PLAYING, State.VOID_PENDING)
+    flush(loop)
+    assert playing.done()
+
+
+def test_superseded_target(loop, operations):
+    playing = operations.expect_state(State.PLAYING)
+    paused = operations.expect_state(State.PAUSED)
+    operations.state_changed(State.PAUSED, State.VOID_PENDING)
+    flush(loop)
+    assert playing.done() and paused.done()
+    assert playing.exception() is None
+
+
+def test_async_done_by_seqnum(loop, operations):
+    first = operations.expect_event(1)
+    second = operations.expect_event(2)
+    operations.async_done(2)
+    flush(loop)
+    assert second.done() and not first.done()
+
+
+def test_async_done_unknown_seqnum_falls_back_to_oldest_event(loop, operations):
+    first = operations.expect_event(1)
+    second = operations.expect_event(2)
+    operations.async_done(99)
+    flush(loop)
+    assert first.done() and not second.done()
+
+
+def test_async_done_unknown_seqnum_with_pending_state(loop, operations):
+    state = operations.expect_state(State.PAUSED)
+    event = operations.expect_event(1)
+    operations.async_done(99)
+    flush(loop)
+    assert not event.done() and not state.done()
+    operations.async_done(1)
+    flush(loop)
+    assert event.done()
+
+
+@pytest.mark.parametrize('state', [State.NULL, State.READY])
+def test_stopped_pipeline_fails_operations(loop, operations, state):
+    change = operations.expect_state(State.PLAYING)
+    event = operations.expect_event(1)
+    operations.state_changed(state, State.VOID_PENDING)
+    flush(loop)
+    for ft in (change, event):
+        with pytest.raises(PlaybinError):
+            ft.result()
+    assert not operations.fail(PlaybinError('Nothing left'))
+
+
+def test_fail(loop, operations):
+    assert not operations.fail(PlaybinError('Nothing pending'))
+    ft = operations.expect_event(1)
+    assert operations.fail(PlaybinError('Error'))
+    flush(loop)
+    with pytest.raises(PlaybinError, match='Error'):
+        ft.result()
+
+
+def test_discard(loop, operations):
+    change = operations.expect_state(State.PLAYING)
+    event = operations.expect_event(1)
+    operations.discard(change)
+    operations.discard(event)
+    assert not operations.fail(PlaybinError('Nothing pending'))
+
+
+def run_pipeline_base(loop, scenario):
+    async def main():
+        base = PipelineBase(loop=loop)
+        base._operations.pipeline = StubPipeline(State.PAUSED, State.VOID_PENDING)
+        return await scenario(base)
+    return loop.run_until_complete(main())
+
+
+def test_timeout_unregisters_operation(loop):
+    async def scenario(base):
+        ft = base._operations.expect_event(1)
+        with pytest.raises(PlaybinTimeout):
+            await base._wait('seek', ft, 0.01)
+        return base._operations.fail(PlaybinError('Nothing pending'))
+
+    assert not run_pipeline_base(loop, scenario)
+
+
+def test_default_timeout(loop):
+    async def scenario(base):
+        base.timeout = 0.01
+        with pytest.raises(PlaybinTimeout, match='Pause'):
+            await base._wait('pause', base._operations.expect_state(State.PLAYING), None)
+        return base._operations.fail(PlaybinError('Nothing pending'))
+
+    assert not run_pipeline_base(loop, scenario)
+
+
+def test_cancellation_unregisters_operation(loop):
+    async def scenario(base):
+        task = asyncio.ensure_future(base._wait('seek', base._operations.expect_event(1), None))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return base._operations.fail(PlaybinError('Nothing pending'))
+
+    assert not run_pipeline_base(loop, scenario)